@@ -0,0 +1,108 @@
+"""Бенчмарк одновременных входов: 1000 клиентов выполняют /login к серверу
+в том же процессе, а фоновая задача каждые 10 мс измеряет задержку цикла
+событий. Сравнивает проверку паролей в пуле потоков и прямо в цикле
+событий (--workers 0), результат печатается в JSON.
+
+Запуск из корня проекта:
+    python -m benchmarks.auth_bench --logins 1000 --workers 4
+    python -m benchmarks.auth_bench --logins 1000 --workers 0
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from benchmarks.load_bench import free_port, percentile, raise_file_limit
+from models import User
+from passwords import PasswordHasher, hash_password
+from ratelimit import RateLimits
+from server import Server
+from utils import EXIT, HOST, LOGIN, LOGIN_SUCCESSFUL, MAX_LINE_LENGTH
+
+PASSWORD = 'password'
+
+
+async def watch_lag(lags: list[float], interval: float = 0.01) -> None:
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - started - interval))
+
+
+async def login(port: int, user: str) -> bool:
+    reader, writer = await asyncio.open_connection(
+        HOST, port, limit=MAX_LINE_LENGTH)
+    writer.write(f'{LOGIN}\n{user}\n{PASSWORD}\n'.encode())
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return False
+            if line.decode().strip() == LOGIN_SUCCESSFUL:
+                writer.write(f'{EXIT}\n'.encode())
+                while await reader.readline():
+                    pass
+                return True
+    finally:
+        writer.close()
+
+
+async def run(args: argparse.Namespace) -> dict:
+    logging.getLogger('chat-service').setLevel(logging.WARNING)
+    port = free_port()
+    server = Server(
+        event_loop=asyncio.get_running_loop(),
+        port=port,
+        rate_limits=RateLimits.unlimited(),
+        password_hasher=PasswordHasher(args.workers,
+                                       max_pending=args.logins * 2))
+    # один хеш на всех пользователей: подготовка не должна занимать
+    # больше времени, чем сам замер
+    stored = hash_password(PASSWORD)
+    users = [f'user{number}' for number in range(args.logins // args.devices)]
+    for user in users:
+        server.users[user] = User(user, stored)
+    await server.run_server()
+
+    lags: list[float] = []
+    lag_task = asyncio.create_task(watch_lag(lags))
+    await asyncio.sleep(0.1)
+    idle_lags = len(lags)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        login(port, user) for user in users for _ in range(args.devices)))
+    elapsed = time.perf_counter() - start
+    lag_task.cancel()
+    server.hasher.close()
+
+    lags_ms = [lag * 1000 for lag in lags[idle_lags:]]
+    return {
+        'workers': args.workers,
+        'logins': len(results),
+        'successful': sum(results),
+        'seconds': elapsed,
+        'logins_per_s': len(results) / elapsed,
+        'cache_hits': server.hasher.cache_hits.value,
+        'loop_lag_ms': {
+            'p50': percentile(lags_ms, 50),
+            'p99': percentile(lags_ms, 99),
+            'max': max(lags_ms, default=None),
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--logins', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4,
+                        help='потоков для хеширования, 0 - в цикле событий')
+    parser.add_argument('--devices', type=int, default=1,
+                        help='входов на одного пользователя')
+    args = parser.parse_args()
+    raise_file_limit()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Бенчмарк журнала операций: пропускная способность отправки сообщений с
+журналом и без него и время восстановления состояния из журнала.
+
+Запуск из корня проекта:
+    python -m benchmarks.journal_bench --messages 100000 --senders 100 \
+        --recovery-messages 10000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Optional
+
+from models import Message
+from server import Server
+
+
+async def send_messages(server: Server, count: int, senders: int) -> None:
+    """Отправка count сообщений senders параллельными отправителями так же,
+    как это делают обработчики сервера: запись в историю и ожидание
+    фиксации в журнале."""
+
+    async def sender(number: int) -> None:
+        login = f'user{number}'
+        for i in range(count // senders):
+            message = Message(f'message number {i}', login)
+            server.history.append(message)
+            await server.save_message(message)
+
+    await asyncio.gather(*(sender(number) for number in range(senders)))
+
+
+def throughput(count: int,
+               senders: int,
+               directory: Optional[str] = None,
+               sync: bool = True
+               ) -> float:
+    server = Server(journal_dir=directory)
+
+    async def run() -> float:
+        if server.journal:
+            server.journal.sync = sync
+            server.journal.open()
+            server.journal.state_provider = server.dump_state
+        start = time.perf_counter()
+        await send_messages(server, count, senders)
+        if server.journal:
+            await server.journal.close()
+        return count / (time.perf_counter() - start)
+
+    return asyncio.run(run())
+
+
+def write_log(directory: str, count: int) -> None:
+    """Генерация журнала из count сообщений напрямую в файл."""
+
+    pub_date = time.time()
+    with open(os.path.join(directory, 'journal.0.log'), 'w') as file:
+        for seq in range(1, count + 1):
+            file.write(json.dumps({
+                'seq': seq,
+                'op': 'message',
+                'login': f'user{seq % 100}',
+                'text': f'message number {seq}',
+                'is_private': False,
+                'recipient': '',
+                'chat_name': '',
+                'pub_date': pub_date}) + '\n')
+
+
+def recovery(count: int) -> tuple[float, float]:
+    """Время генерации журнала и время восстановления из него."""
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        write_log(directory, count)
+        generated = time.perf_counter() - start
+        server = Server(journal_dir=directory)
+        start = time.perf_counter()
+        server.restore()
+        return generated, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--senders', type=int, default=100)
+    parser.add_argument('--recovery-messages', type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    off = throughput(args.messages, args.senders)
+    print(f'journal off:         {off:12.0f} messages/s')
+    with tempfile.TemporaryDirectory() as directory:
+        no_sync = throughput(args.messages, args.senders, directory, False)
+    print(f'journal, no fsync:   {no_sync:12.0f} messages/s')
+    with tempfile.TemporaryDirectory() as directory:
+        on = throughput(args.messages, args.senders, directory)
+    print(f'journal, fsync:      {on:12.0f} messages/s')
+
+    generated, restored = recovery(args.recovery_messages)
+    print(f'log of {args.recovery_messages} messages generated in '
+          f'{generated:.1f} s, recovered in {restored:.1f} s '
+          f'({args.recovery_messages / restored:.0f} records/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""Нагрузочный бенчмарк сервера через loopback.
+
+Запускает сервер в отдельном процессе (или в текущем), подключает тысячи
+асинхронных клиентов, которые регистрируются через /auth и отправляют
+/send, /private и /send_chat с заданной частотой. Сообщает соединения в
+секунду, сообщения в секунду, задержку доставки p50/p95/p99 и прирост
+памяти сервера, результат печатается в JSON для сравнения между коммитами.
+
+Запуск из корня проекта:
+    python -m benchmarks.load_bench --clients 1000 --rate 1 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+from typing import Optional
+
+from ratelimit import RateLimits
+from server import Server
+from utils import GENERAL_CHAT, HOST, MAX_LINE_LENGTH
+
+MARKER = '#bench '
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values: list[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+def rss(pid: int) -> Optional[int]:
+    """Resident set size процесса в байтах (только Linux)."""
+
+    try:
+        with open(f'/proc/{pid}/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def raise_file_limit() -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class Stats:
+    def __init__(self):
+        self.connected: int = 0
+        self.sent: int = 0
+        self.delivered: int = 0
+        self.latencies: list[float] = []
+        self.errors: int = 0
+
+
+class BenchClient:
+    """Имитация пользователя: регистрация, вход в чат и отправка
+    сообщений с меткой времени, по которой получатели считают задержку."""
+
+    def __init__(self, number: int, prefix: str, stats: Stats):
+        self.number: int = number
+        self.login: str = f'{prefix}{number}'
+        self.stats: Stats = stats
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.invites: asyncio.Queue = asyncio.Queue()
+        self.joined: asyncio.Event = asyncio.Event()
+        self.read_task: Optional[asyncio.Task] = None
+
+    async def connect(self, host: str, port: int) -> None:
+        self.reader, self.writer = await asyncio.open_connection(
+            host, port, limit=MAX_LINE_LENGTH)
+        self.writer.write(f'/auth\n{self.login}\npassword\n'.encode())
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError('Server closed the connection.')
+            if line.decode().strip() == GENERAL_CHAT:
+                break
+        self.stats.connected += 1
+        self.read_task = asyncio.create_task(self.read())
+
+    async def read(self) -> None:
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            text = line.decode(errors='replace')
+            position = text.find(MARKER)
+            if position >= 0:
+                sent = float(text[position + len(MARKER):].split()[0])
+                self.stats.latencies.append(time.time() - sent)
+                self.stats.delivered += 1
+            elif 'Your invite key is ' in text:
+                words = text.split()
+                self.invites.put_nowait((words[6], words[-1]))
+            elif text.startswith('You are join to chat'):
+                self.joined.set()
+
+    def command(self, text: str) -> None:
+        self.writer.write(f'{text}\n'.encode())
+
+    async def run(self,
+                  duration: float,
+                  rate: float,
+                  mix: dict[str, float],
+                  peers: list[str],
+                  chat: str
+                  ) -> None:
+        commands = list(mix)
+        weights = [mix[command] for command in commands]
+        deadline = time.monotonic() + duration
+        # равномерно разносим отправки клиентов во времени
+        await asyncio.sleep(random.random() / rate)
+        while time.monotonic() < deadline:
+            command = random.choices(commands, weights)[0]
+            body = f'{MARKER}{time.time()!r} payload'
+            if command == 'private':
+                self.command(f'/private {random.choice(peers)} {body}')
+            elif command == 'chat':
+                self.command(f'/send_chat {chat} {body}')
+            else:
+                self.command(f'/send {body}')
+            self.stats.sent += 1
+            await self.writer.drain()
+            await asyncio.sleep(1 / rate)
+
+    async def close(self) -> None:
+        try:
+            self.command('/exit')
+            await self.writer.drain()
+            self.writer.close()
+        except Exception:
+            pass
+        if self.read_task:
+            self.read_task.cancel()
+
+
+async def setup_chats(clients: list[BenchClient], chat_size: int) -> None:
+    """Создание чатов по chat_size участников: первый участник группы
+    создаёт чат и приглашает остальных, они входят по инвайт-ключу."""
+
+    groups = [clients[i:i + chat_size]
+              for i in range(0, len(clients), chat_size)]
+    for group in groups:
+        admin = group[0]
+        admin.command(f'/create room{admin.login}')
+        for member in group[1:]:
+            admin.command(f'/invite {member.login} room{admin.login}')
+        admin.joined.set()
+
+    async def join(member: BenchClient) -> None:
+        chat_name, key = await member.invites.get()
+        member.command(f'/join {chat_name} {key}')
+        await member.joined.wait()
+
+    members = [member for group in groups for member in group[1:]]
+    await asyncio.wait_for(
+        asyncio.gather(*(join(member) for member in members)), 60)
+
+
+async def run_load(args: argparse.Namespace, server_pid: int) -> dict:
+    stats = Stats()
+    prefix = f'bot{random.randrange(10 ** 6)}_'
+    clients = [BenchClient(number, prefix, stats)
+               for number in range(args.clients)]
+    memory_before = rss(server_pid)
+
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(client: BenchClient) -> None:
+        async with semaphore:
+            try:
+                await client.connect(args.host, args.port)
+            except Exception:
+                stats.errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connect(client) for client in clients))
+    connect_time = time.perf_counter() - start
+    clients = [client for client in clients if client.read_task]
+    await setup_chats(clients, args.chat_size)
+
+    mix = {'send': args.send, 'private': args.private, 'chat': args.chat}
+    logins = [client.login for client in clients]
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client.run(args.duration, args.rate, mix, logins,
+                   f'room{clients[i - i % args.chat_size].login}')
+        for i, client in enumerate(clients)))
+    send_time = time.perf_counter() - start
+    # ждём хвост доставки
+    await asyncio.sleep(args.settle)
+    memory_after = rss(server_pid)
+    for client in clients:
+        await client.close()
+
+    latencies_ms = [latency * 1000 for latency in stats.latencies]
+    return {
+        'clients': args.clients,
+        'connected': stats.connected,
+        'connect_errors': stats.errors,
+        'connections_per_s': stats.connected / connect_time,
+        'messages_sent': stats.sent,
+        'messages_per_s': stats.sent / send_time,
+        'deliveries': stats.delivered,
+        'deliveries_per_s': stats.delivered / (send_time + args.settle),
+        'latency_ms': {
+            'p50': percentile(latencies_ms, 50),
+            'p95': percentile(latencies_ms, 95),
+            'p99': percentile(latencies_ms, 99),
+        },
+        'server_rss_before': memory_before,
+        'server_rss_after': memory_after,
+        'server_rss_growth': (memory_after - memory_before
+                              if memory_before and memory_after else None),
+    }
+
+
+def make_server(port: int) -> Server:
+    return Server(port=port,
+                  sent_message_per_user=10 ** 9,
+                  rate_limits=RateLimits.unlimited())
+
+
+def serve(port: int) -> None:
+    logging.getLogger('chat-service').setLevel(logging.WARNING)
+    asyncio.run(make_server(port).run_server())
+
+
+def start_subprocess(args: argparse.Namespace) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.load_bench', '--serve',
+         '--port', str(args.port)],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((args.host, args.port)).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('Server did not start.')
+
+
+async def run_inprocess(args: argparse.Namespace) -> dict:
+    logging.getLogger('chat-service').setLevel(logging.WARNING)
+    server = make_server(args.port)
+    server.event_loop = asyncio.get_running_loop()
+    await server.run_server()
+    return await run_load(args, os.getpid())
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--server', default='subprocess',
+                        choices=('subprocess', 'inprocess', 'external'))
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--server-pid', type=int, default=0,
+                        help='pid внешнего сервера для замера памяти')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--connect-concurrency', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='сообщений в секунду на клиента')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--settle', type=float, default=2.0)
+    parser.add_argument('--chat-size', type=int, default=10)
+    parser.add_argument('--send', type=float, default=0.2,
+                        help='доля /send в трафике')
+    parser.add_argument('--private', type=float, default=0.5,
+                        help='доля /private в трафике')
+    parser.add_argument('--chat', type=float, default=0.3,
+                        help='доля /send_chat в трафике')
+    parser.add_argument('--output', help='файл для JSON-результата')
+    parser.add_argument('--serve', action='store_true',
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.serve:
+        serve(args.port)
+        return
+    raise_file_limit()
+    args.port = args.port or free_port()
+    process = None
+    if args.server == 'inprocess':
+        result = asyncio.run(run_inprocess(args))
+    else:
+        server_pid = args.server_pid
+        if args.server == 'subprocess':
+            process = start_subprocess(args)
+            server_pid = process.pid
+        try:
+            result = asyncio.run(run_load(args, server_pid))
+        finally:
+            if process:
+                process.terminate()
+                process.wait()
+    result['server'] = args.server
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
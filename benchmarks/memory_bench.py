@@ -0,0 +1,88 @@
+"""Бенчмарк памяти: сколько байт занимает одно сообщение, хранимое в
+истории, до и после перехода на компактное представление Message.
+
+Запуск из корня проекта:
+    python -m benchmarks.memory_bench --messages 1000000
+"""
+import argparse
+import gc
+import tracemalloc
+from datetime import datetime
+from typing import Callable
+
+from history import History
+from models import Message
+
+
+class LegacyMessage:
+    """Прежнее представление сообщения: объект с __dict__, datetime и
+    отформатированный при создании текст."""
+
+    def __init__(self,
+                 text: str,
+                 login: str,
+                 is_private: bool = False,
+                 recipient: str = '',
+                 chat_name: str = ''):
+        self.is_private = is_private
+        self.login = login
+        self.pub_date = datetime.now()
+        self.recipient = recipient
+        self.chat_name = chat_name
+        self.text = self.format_message(text)
+
+    def format_message(self, text: str) -> str:
+        pub_date = self.pub_date.strftime('%Y.%m.%d %H:%M:%S')
+        private = 'in private ' if self.is_private else ''
+        return f'{pub_date} {self.login} {private}says: {text}'
+
+
+def measure(count: int, fill: Callable[[int], object]) -> float:
+    """Прирост памяти на одно сообщение при заполнении хранилища."""
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    storage = fill(count)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del storage
+    return (after - before) / count
+
+
+def legacy(count: int) -> list:
+    return [LegacyMessage(f'message number {i}', f'user{i % 100}')
+            for i in range(count)]
+
+
+def compact(count: int) -> History:
+    history = History()
+    for i in range(count):
+        history.append(Message(f'message number {i}', f'user{i % 100}'))
+    return history
+
+
+def compact_delivered(count: int) -> History:
+    history = compact(count)
+    for message in history.messages():
+        message.text
+    return history
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    args = parser.parse_args()
+    results = (
+        ('before: list of legacy messages', legacy),
+        ('after: History, not delivered', compact),
+        ('after: History, text rendered', compact_delivered),
+    )
+    for title, fill in results:
+        print(f'{title:35} {measure(args.messages, fill):8.1f} '
+              f'bytes/message')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import asyncio
+import json
+from asyncio.streams import StreamReader, StreamWriter
+from typing import Awaitable, Callable, Optional
+
+from protocol import read_line
+from utils import get_logger
+
+logger = get_logger()
+
+BROKER_LIMIT = 16 * 1024 * 1024
+READY = b'ready\n'
+START = b'start\n'
+
+
+class Broker:
+    """Локальный брокер многопроцессного режима. Воркеры подключаются к нему
+    через unix-сокет и присылают операции, изменяющие состояние, и
+    уведомления; брокер пересылает каждую строку всем остальным воркерам.
+    Воркеры начинают принимать клиентов только после того, как все они
+    восстановили состояние и сообщили о готовности."""
+
+    def __init__(self, path: str, workers: int):
+        self.path: str = path
+        self.workers: int = workers
+        self.ready: int = 0
+        self.writers: list[StreamWriter] = []
+
+    async def handle_worker(self,
+                            reader: StreamReader,
+                            writer: StreamWriter
+                            ) -> None:
+        self.writers.append(writer)
+        try:
+            while True:
+                line = await read_line(reader)
+                if not line:
+                    break
+                if line == READY:
+                    self.ready += 1
+                    if self.ready == self.workers:
+                        logger.info('All %s workers are ready.', self.workers)
+                        for other in self.writers:
+                            other.write(START)
+                    continue
+                for other in self.writers:
+                    if other is not writer:
+                        other.write(line)
+        finally:
+            self.writers.remove(writer)
+            writer.close()
+            logger.warning('Worker disconnected from broker.')
+
+    async def run(self) -> None:
+        instance = await asyncio.start_unix_server(
+            self.handle_worker,
+            self.path,
+            limit=BROKER_LIMIT)
+        logger.info('Broker running at %s', self.path)
+        async with instance:
+            await instance.serve_forever()
+
+
+class BrokerLink:
+    """Подключение воркера к брокеру: публикация своих операций и
+    применение операций других воркеров."""
+
+    def __init__(self,
+                 path: str,
+                 apply: Callable[[dict], Awaitable[None]],
+                 connect_timeout: float = 10.0):
+        self.path: str = path
+        self.apply: Callable[[dict], Awaitable[None]] = apply
+        self.connect_timeout: float = connect_timeout
+        self.reader: Optional[StreamReader] = None
+        self.writer: Optional[StreamWriter] = None
+        self.listen_task: Optional[asyncio.Task] = None
+
+    async def connect(self) -> None:
+        """Подключение к брокеру и ожидание готовности всех воркеров. Брокер
+        может запуститься позже воркера, поэтому подключение повторяется до
+        connect_timeout."""
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.connect_timeout
+        while True:
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(
+                    self.path,
+                    limit=BROKER_LIMIT)
+                break
+            except OSError:
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(0.05)
+        self.writer.write(READY)
+        while True:
+            line = await read_line(self.reader)
+            if not line:
+                raise ConnectionError('Broker closed the connection.')
+            if line == START:
+                break
+        self.listen_task = asyncio.create_task(self.listen())
+
+    def publish(self, record: dict) -> None:
+        if self.writer:
+            self.writer.write(json.dumps(record).encode() + b'\n')
+
+    async def listen(self) -> None:
+        while True:
+            line = await read_line(self.reader)
+            if not line:
+                logger.error('Connection to broker lost.')
+                return
+            try:
+                await self.apply(json.loads(line))
+            except Exception as error:
+                logger.error('Broker record not applied.', exc_info=error)
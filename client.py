@@ -1,33 +1,71 @@
 import asyncio
+import os
 from asyncio import StreamReader, StreamWriter
 from signal import SIG_DFL, SIGPIPE, signal
 from typing import Optional
 
 from aioconsole import ainput
 
-from utils import BYTES, COMMANDS_DESCRIPTION, EXIT, HOST, PORT
+from protocol import FrameTooLongError, encode_line, read_line
+from utils import (COMMANDS_DESCRIPTION, EXIT, HOST, INVALID_SESSION,
+                   MAX_LINE_LENGTH, PORT, RESUME, RESUME_TOKEN, SESSION_FILE)
 
 signal(SIGPIPE, SIG_DFL)
 
 
 class Client:
-    def __init__(self, server_host: str = HOST, server_port: int = PORT):
+    def __init__(self,
+                 server_host: str = HOST,
+                 server_port: int = PORT,
+                 session_path: Optional[str] = None):
         self.host = server_host
         self.port = server_port
         self.reader: Optional[StreamReader] = None
         self.writer: Optional[StreamWriter] = None
+        self.session_path: Optional[str] = session_path
+        self.token: Optional[str] = self.load_token()
+
+    def load_token(self) -> Optional[str]:
+        if not self.session_path or not os.path.exists(self.session_path):
+            return None
+        with open(self.session_path) as file:
+            return file.read().strip() or None
+
+    def save_token(self, token: Optional[str]) -> None:
+        """Сохранение токена сессии, выданного сервером после входа, для
+        следующих подключений."""
+
+        self.token = token
+        if not self.session_path:
+            return
+        if token is None:
+            if os.path.exists(self.session_path):
+                os.remove(self.session_path)
+            return
+        with open(self.session_path, 'w') as file:
+            file.write(token)
+
+    def handle_line(self, text: str) -> None:
+        if text.startswith(RESUME_TOKEN):
+            self.save_token(text[len(RESUME_TOKEN):])
+            return
+        if text == INVALID_SESSION:
+            self.save_token(None)
+        print(text)
 
     async def receive(self) -> None:
-        server_message = ''
-        while server_message != EXIT:
+        while True:
             try:
-                data = await self.reader.read(BYTES)
+                data = await read_line(self.reader)
+            except FrameTooLongError as error:
+                print(error)
+                continue
             except Exception as error:
                 print(error)
-            else:
-                if data:
-                    print(data.decode())
-                await asyncio.sleep(0.1)
+                break
+            if not data:
+                break
+            self.handle_line(data.decode(errors='replace').rstrip())
         try:
             self.writer.close()
             await self.writer.wait_closed()
@@ -38,9 +76,12 @@ class Client:
         client_message = ''
         while client_message != EXIT:
             client_message = await ainput('> ')
-            self.writer.write(client_message.encode())
+            data = encode_line(client_message)
+            if len(data) > MAX_LINE_LENGTH:
+                print(f'Message is longer than {MAX_LINE_LENGTH} bytes.')
+                continue
+            self.writer.write(data)
             await self.writer.drain()
-            await asyncio.sleep(0.1)
         print('Client disconnected.')
         self.writer.close()
 
@@ -51,7 +92,11 @@ class Client:
         try:
             self.reader, self.writer = await asyncio.open_connection(
                 self.host,
-                self.port)
+                self.port,
+                limit=MAX_LINE_LENGTH)
+            if self.token:
+                # вход по токену без диалога логина и пароля
+                self.writer.write(encode_line(f'{RESUME} {self.token}'))
             await asyncio.gather(self.send(), self.receive())
         except Exception as error:
             print(error)
@@ -59,7 +104,7 @@ class Client:
 
 
 if __name__ == '__main__':
-    client = Client()
+    client = Client(session_path=SESSION_FILE)
     try:
         asyncio.run(client.run_client())
     except KeyboardInterrupt:
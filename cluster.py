@@ -0,0 +1,86 @@
+"""Многопроцессный режим сервера: N воркеров слушают один host:port через
+SO_REUSEPORT, а локальный брокер пересылает между ними операции, чтобы
+пользователи разных воркеров видели общее состояние и сообщения.
+
+Запуск:
+    python cluster.py --workers 4 --host 127.0.0.1 --port 8000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+from broker import Broker, BrokerLink
+from server import Server
+from utils import HOST, JOURNAL_DIR, PORT, get_logger
+
+logger = get_logger()
+
+
+def run_worker(number: int,
+               host: str,
+               port: int,
+               broker_path: str,
+               journal_dir: Optional[str]
+               ) -> None:
+    """Процесс воркера. Все воркеры восстанавливают состояние из журнала,
+    но пишет в журнал только нулевой: через брокер он получает все операции
+    остальных воркеров."""
+
+    server = Server(
+        host=host,
+        port=port,
+        journal_dir=journal_dir,
+        reuse_port=True)
+    if number and server.journal:
+        server.restore()
+        server.journal = None
+    server.broker = BrokerLink(broker_path, server.apply_remote)
+    logger.info('Worker %s started with pid %s.', number, os.getpid())
+    try:
+        asyncio.run(server.run_server())
+    except KeyboardInterrupt:
+        logger.info('Worker %s stopped.', number)
+
+
+def run_cluster(workers: int,
+                host: str = HOST,
+                port: int = PORT,
+                journal_dir: Optional[str] = JOURNAL_DIR
+                ) -> None:
+    """Запуск воркеров и брокера в текущем процессе."""
+
+    broker_dir = tempfile.mkdtemp()
+    broker_path = os.path.join(broker_dir, 'broker.sock')
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(number, host, port, broker_path, journal_dir),
+            daemon=True)
+        for number in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        asyncio.run(Broker(broker_path, workers).run())
+    except KeyboardInterrupt:
+        logger.info('Cluster stopped.')
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        shutil.rmtree(broker_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--journal-dir', default=JOURNAL_DIR)
+    args = parser.parse_args()
+    run_cluster(args.workers, args.host, args.port, args.journal_dir or None)
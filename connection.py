@@ -0,0 +1,209 @@
+import asyncio
+import time
+from asyncio.streams import StreamReader, StreamWriter
+from collections import Counter
+from typing import Optional
+
+from metrics import SAMPLE_EVERY, Histogram
+from utils import get_logger
+
+logger = get_logger()
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEW = 'drop_new'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP_OLDEST, DROP_NEW, DISCONNECT)
+
+
+class OutboundLimits:
+    """Ограничения исходящего буфера соединения: размер очереди, верхняя и
+    нижняя границы буферизованных байт и политика для клиента, который
+    держится выше верхней границы."""
+
+    def __init__(self,
+                 queue_size: int = 1000,
+                 high_water: int = 1024 * 1024,
+                 low_water: int = 256 * 1024,
+                 policy: str = DROP_OLDEST,
+                 grace_period: float = 10.0):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown overflow policy {policy}.')
+        if low_water > high_water:
+            raise ValueError('Low water mark is above high water mark.')
+        self.queue_size: int = queue_size
+        self.high_water: int = high_water
+        self.low_water: int = low_water
+        self.policy: str = policy
+        self.grace_period: float = grace_period
+
+
+class Connection:
+    """Клиентское соединение с собственной ограниченной очередью исходящих
+    сообщений. Очередь разбирается отдельной задачей-писателем, поэтому
+    рассылка не ждёт медленных получателей, а порядок сообщений для каждого
+    получателя сохраняется.
+
+    Если в очереди и буфере транспорта накапливается больше high_water байт,
+    применяется политика: отбросить старые сообщения до low_water, отбросить
+    новые или отключить клиента, не разгрузившегося за grace_period. Каждое
+    действие учитывается в stats соединения и в общем счётчике сервера."""
+
+    def __init__(self,
+                 address: str,
+                 reader: StreamReader,
+                 writer: StreamWriter,
+                 limits: Optional[OutboundLimits] = None,
+                 totals: Optional[Counter] = None,
+                 write_timing: Optional[Histogram] = None):
+        self.address: str = address
+        self.reader: StreamReader = reader
+        self.writer: StreamWriter = writer
+        self.limits: OutboundLimits = limits or OutboundLimits()
+        self.queue: asyncio.Queue[Optional[bytes]] = asyncio.Queue(
+            self.limits.queue_size)
+        self.queued_bytes: int = 0
+        self.overflow_since: Optional[float] = None
+        self.stats: Counter = Counter()
+        self.totals: Counter = totals if totals is not None else Counter()
+        self.write_timing: Optional[Histogram] = write_timing
+        self.writes_count: int = 0
+        self.closed: bool = False
+        self.writer_task: asyncio.Task = asyncio.create_task(
+            self.drain_queue())
+
+    @property
+    def buffered(self) -> int:
+        """Байты, ожидающие отправки: в очереди и в буфере транспорта."""
+
+        return (self.queued_bytes
+                + self.writer.transport.get_write_buffer_size())
+
+    def count(self, action: str, amount: int = 1) -> None:
+        self.stats[action] += amount
+        self.totals[action] += amount
+
+    def put(self, data: bytes) -> bool:
+        """Постановка данных в очередь отправки без ожидания."""
+
+        if self.closed:
+            return False
+        if (self.buffered + len(data) > self.limits.high_water
+                or self.queue.full()):
+            if not self.overflow(len(data)):
+                return False
+        self.queue.put_nowait(data)
+        self.queued_bytes += len(data)
+        return True
+
+    def overflow(self, size: int) -> bool:
+        """Применение политики к переполненному соединению. Возвращает True,
+        если новое сообщение всё же можно поставить в очередь."""
+
+        if self.overflow_since is None:
+            self.overflow_since = time.monotonic()
+            logger.warning(
+                'Client %s is above high water mark (%s bytes buffered), '
+                'policy %s applied.',
+                self.address,
+                self.buffered,
+                self.limits.policy)
+            if self.limits.policy == DISCONNECT:
+                asyncio.get_running_loop().call_later(
+                    self.limits.grace_period, self.check_overflow)
+        if self.limits.policy == DROP_OLDEST:
+            dropped = 0
+            while not self.queue.empty() and (
+                    self.buffered + size > self.limits.low_water
+                    or self.queue.full()):
+                self.queued_bytes -= len(self.queue.get_nowait())
+                dropped += 1
+            self.count(DROP_OLDEST, dropped)
+            return not self.queue.full()
+        if self.limits.policy == DISCONNECT and not self.queue.full():
+            return True
+        self.count(DROP_NEW)
+        return False
+
+    def check_overflow(self) -> None:
+        """Отключение клиента, не разгрузившегося за время ожидания."""
+
+        if self.closed or self.overflow_since is None:
+            return
+        if time.monotonic() - self.overflow_since < self.limits.grace_period:
+            return
+        self.count(DISCONNECT)
+        logger.warning(
+            'Client %s stayed above high water mark for %s s, '
+            'disconnecting.',
+            self.address,
+            self.limits.grace_period)
+        self.abort()
+
+    def recovered(self) -> None:
+        if self.overflow_since is None:
+            return
+        self.overflow_since = None
+        logger.info(
+            'Client %s is below low water mark again, dropped so far: '
+            'oldest %s, new %s.',
+            self.address,
+            self.stats[DROP_OLDEST],
+            self.stats[DROP_NEW])
+
+    def abort(self) -> None:
+        """Немедленный разрыв соединения без отправки буфера."""
+
+        self.closed = True
+        self.writer_task.cancel()
+        self.writer.transport.abort()
+
+    async def drain_queue(self) -> None:
+        """Задача-писатель: последовательно отправляет данные из очереди."""
+
+        while True:
+            data = await self.queue.get()
+            if data is None:
+                break
+            self.queued_bytes -= len(data)
+            self.writes_count += 1
+            started = time.perf_counter()
+            self.writer.write(data)
+            try:
+                await self.writer.drain()
+            except Exception as error:
+                logger.error(error)
+                self.closed = True
+                await self.close_writer()
+                break
+            if self.write_timing and not self.writes_count % SAMPLE_EVERY:
+                self.write_timing.observe(time.perf_counter() - started)
+            if (self.overflow_since is not None
+                    and self.buffered <= self.limits.low_water):
+                self.recovered()
+
+    async def close_writer(self) -> None:
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except Exception as error:
+            logger.error(
+                'Error when closing writer %s %s.',
+                self.address,
+                error)
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """Закрытие соединения после отправки уже поставленных в очередь
+        сообщений."""
+
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await asyncio.wait_for(self.queue.put(None), timeout)
+            await asyncio.wait_for(self.writer_task, timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                'Outbound queue of %s was not flushed in time.',
+                self.address)
+            self.writer_task.cancel()
+        await self.close_writer()
@@ -0,0 +1,141 @@
+from bisect import bisect_right
+from collections import defaultdict
+from heapq import merge
+from typing import Iterable
+
+from models import Message
+
+GENERAL_CHANNEL = 'general'
+
+
+def chat_channel(chat_name: str) -> str:
+    """Имя канала приватного чата."""
+
+    return f'chat:{chat_name}'
+
+
+def private_channel(login: str, other_login: str) -> str:
+    """Имя канала личной переписки двух пользователей. Не зависит от того,
+    кто из них отправитель."""
+
+    first, second = sorted((login, other_login))
+    return f'private:{first}:{second}'
+
+
+class Channel:
+    """Сообщения одного канала в порядке публикации с индексом по времени."""
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self.messages: list[Message] = []
+        self.dates: list[float] = []
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def append(self, message: Message) -> None:
+        # системные часы могут перевести назад - индекс по времени остаётся
+        # упорядоченным, чтобы по нему работал бинарный поиск
+        timestamp = message.timestamp
+        if self.dates and timestamp < self.dates[-1]:
+            timestamp = self.dates[-1]
+        self.messages.append(message)
+        self.dates.append(timestamp)
+
+    def tail(self, depth: int) -> list[Message]:
+        """Последние depth сообщений канала."""
+
+        if depth <= 0:
+            return []
+        return self.messages[-depth:]
+
+    def since(self, timestamp: float) -> list[Message]:
+        """Сообщения, опубликованные позже timestamp."""
+
+        return self.messages[bisect_right(self.dates, timestamp):]
+
+    def after(self, last_id: int) -> list[Message]:
+        """Сообщения с идентификатором больше last_id."""
+
+        position = bisect_right(self.messages, last_id,
+                                key=lambda message: message.id)
+        return self.messages[position:]
+
+
+class History:
+    """Хранилище истории сообщений, разбитое по каналам: общий чат, каждый
+    приватный чат и каждая пара пользователей в личной переписке. Сообщения
+    получают сквозной монотонный идентификатор."""
+
+    def __init__(self):
+        self.channels: dict[str, Channel] = {}
+        self.last_id: int = 0
+        self.private_channels: dict[str, set[str]] = defaultdict(set)
+        self.private_sent: dict[str, int] = defaultdict(int)
+
+    def __len__(self) -> int:
+        return self.last_id
+
+    @staticmethod
+    def channel_name(message: Message) -> str:
+        if message.chat_name:
+            return chat_channel(message.chat_name)
+        if message.is_private:
+            return private_channel(message.login, message.recipient)
+        return GENERAL_CHANNEL
+
+    def channel(self, name: str) -> Channel:
+        if name not in self.channels:
+            self.channels[name] = Channel(name)
+        return self.channels[name]
+
+    def append(self, message: Message) -> Message:
+        """Сохранение сообщения в канал и присвоение ему идентификатора."""
+
+        self.last_id += 1
+        message.id = self.last_id
+        name = self.channel_name(message)
+        self.channel(name).append(message)
+        if message.is_private:
+            self.private_sent[message.login] += 1
+        if message.recipient:
+            self.private_channels[message.login].add(name)
+            self.private_channels[message.recipient].add(name)
+        return message
+
+    def tail(self, name: str, depth: int) -> list[Message]:
+        channel = self.channels.get(name)
+        return channel.tail(depth) if channel else []
+
+    def since(self,
+              names: Iterable[str],
+              timestamp: float
+              ) -> Iterable[Message]:
+        """Сообщения нескольких каналов, опубликованные позже timestamp,
+        в общем порядке публикации."""
+
+        parts = [self.channels[name].since(timestamp)
+                 for name in names if name in self.channels]
+        return merge(*parts, key=lambda message: message.id)
+
+    def after(self,
+              names: Iterable[str],
+              last_id: int
+              ) -> Iterable[Message]:
+        """Сообщения нескольких каналов с идентификатором больше last_id
+        в общем порядке публикации."""
+
+        parts = [self.channels[name].after(last_id)
+                 for name in names if name in self.channels]
+        return merge(*parts, key=lambda message: message.id)
+
+    def messages(self) -> Iterable[Message]:
+        """Все сообщения всех каналов в порядке публикации."""
+
+        return merge(*(channel.messages for channel in self.channels.values()),
+                     key=lambda message: message.id)
+
+    def count_private(self, login: str) -> int:
+        """Количество приватных сообщений, отправленных пользователем."""
+
+        return self.private_sent[login]
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import os
+from typing import Any, Callable, Iterator, Optional
+
+from utils import get_logger
+
+logger = get_logger()
+
+SNAPSHOT_FILE = 'snapshot.json'
+JOURNAL_PREFIX = 'journal.'
+JOURNAL_SUFFIX = '.log'
+
+encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+class Journal:
+    """Журнал операций, изменяющих состояние сервера (write-ahead log).
+
+    Записи копятся в памяти и сбрасываются на диск пачками одним fsync на
+    пачку (group commit): все операции пачки ждут одну и ту же фиксацию.
+    Каждая запись получает сквозной номер seq. После snapshot_every записей
+    состояние сервера сохраняется снимком, журнал начинает новое поколение,
+    а старые поколения удаляются - при старте воспроизводится только хвост
+    журнала после снимка."""
+
+    def __init__(self,
+                 directory: str,
+                 batch_delay: float = 0.002,
+                 batch_size: int = 1000,
+                 snapshot_every: int = 100_000,
+                 sync: bool = True):
+        self.directory: str = directory
+        self.batch_delay: float = batch_delay
+        self.batch_size: int = batch_size
+        self.snapshot_every: int = snapshot_every
+        self.sync: bool = sync
+        self.seq: int = 0
+        self.generation: int = 0
+        self.written_since_snapshot: int = 0
+        self.state_provider: Optional[Callable[[], dict]] = None
+        self.pending: list[str] = []
+        self.batch: Optional[asyncio.Future] = None
+        self.flush_task: Optional[asyncio.Task] = None
+        self.file: Any = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def journal_files(self) -> list[tuple[int, str]]:
+        """Файлы журнала, упорядоченные по номеру поколения."""
+
+        files = []
+        for name in os.listdir(self.directory):
+            if name.startswith(JOURNAL_PREFIX) and name.endswith(
+                    JOURNAL_SUFFIX):
+                generation = name[len(JOURNAL_PREFIX):-len(JOURNAL_SUFFIX)]
+                if generation.isdigit():
+                    files.append((int(generation), self.path(name)))
+        return sorted(files)
+
+    def recover(self) -> tuple[Optional[dict], Iterator[dict]]:
+        """Загрузка последнего снимка и итератор записей журнала, сделанных
+        после него. Обрезанная при аварии последняя строка пропускается."""
+
+        snapshot = None
+        snapshot_path = self.path(SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, encoding='utf-8') as file:
+                snapshot = json.load(file)
+            self.seq = snapshot['seq']
+        files = self.journal_files()
+        if files:
+            self.generation = files[-1][0]
+        return snapshot, self.replay(files, self.seq)
+
+    def replay(self,
+               files: list[tuple[int, str]],
+               after_seq: int
+               ) -> Iterator[dict]:
+        for _, file_path in files:
+            with open(file_path, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logger.warning('Broken journal record in %s skipped.',
+                                       file_path)
+                        continue
+                    if record['seq'] <= after_seq:
+                        continue
+                    self.seq = record['seq']
+                    yield record
+
+    def open(self) -> None:
+        """Открытие текущего поколения журнала на дозапись."""
+
+        file_path = self.path(
+            f'{JOURNAL_PREFIX}{self.generation}{JOURNAL_SUFFIX}')
+        torn = False
+        if os.path.exists(file_path) and os.path.getsize(file_path):
+            with open(file_path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                torn = file.read(1) != b'\n'
+        self.file = open(file_path, 'a', encoding='utf-8')
+        if torn:
+            # отделяем обрезанную при аварии запись от новых
+            self.file.write('\n')
+
+    def append(self, op: str, **fields: Any) -> asyncio.Future:
+        """Добавление записи в журнал. Возвращает future текущей пачки,
+        которая завершится после записи пачки на диск."""
+
+        self.seq += 1
+        self.pending.append(
+            encoder.encode({'seq': self.seq, 'op': op, **fields}))
+        if self.batch is None:
+            self.batch = asyncio.get_running_loop().create_future()
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.flush_loop())
+        return self.batch
+
+    def write_batch(self, lines: list[str]) -> None:
+        self.file.write('\n'.join(lines) + '\n')
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    async def flush_loop(self) -> None:
+        """Групповая фиксация: ждём batch_delay, чтобы в пачку попали
+        записи соседних операций, и пишем её в отдельном потоке."""
+
+        loop = asyncio.get_running_loop()
+        while self.pending:
+            if len(self.pending) < self.batch_size:
+                await asyncio.sleep(self.batch_delay)
+            lines, batch = self.pending, self.batch
+            self.pending, self.batch = [], None
+            try:
+                await loop.run_in_executor(None, self.write_batch, lines)
+            except Exception as error:
+                logger.error('Journal write failed.', exc_info=error)
+                batch.set_exception(error)
+                continue
+            batch.set_result(None)
+            self.written_since_snapshot += len(lines)
+            if (self.state_provider
+                    and self.written_since_snapshot >= self.snapshot_every):
+                await self.snapshot()
+
+    def write_snapshot(self, state: dict, old_files: list[str]) -> None:
+        temp_path = self.path(f'{SNAPSHOT_FILE}.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(state, file, ensure_ascii=False)
+            file.flush()
+            if self.sync:
+                os.fsync(file.fileno())
+        os.replace(temp_path, self.path(SNAPSHOT_FILE))
+        for file_path in old_files:
+            os.remove(file_path)
+
+    async def snapshot(self) -> None:
+        """Сохранение снимка состояния и удаление поглощённых им поколений
+        журнала. Состояние снимается синхронно, поэтому снимок включает все
+        записи с номерами до self.seq, в том числе ещё не записанные: при
+        восстановлении они будут пропущены по seq."""
+
+        state = self.state_provider()
+        state['seq'] = self.seq
+        old_files = [file_path for _, file_path in self.journal_files()]
+        self.file.close()
+        self.generation += 1
+        self.open()
+        self.written_since_snapshot = 0
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                None, self.write_snapshot, state, old_files)
+        except Exception as error:
+            logger.error('Snapshot failed.', exc_info=error)
+            return
+        logger.info('Snapshot saved at journal record %s.', state['seq'])
+
+    async def close(self) -> None:
+        """Сброс оставшихся записей и закрытие файла журнала."""
+
+        if self.flush_task and not self.flush_task.done():
+            await self.flush_task
+        if self.file:
+            self.file.close()
+            self.file = None
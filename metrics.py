@@ -0,0 +1,203 @@
+import asyncio
+import time
+from asyncio.streams import StreamReader, StreamWriter
+from bisect import bisect_left
+from typing import Callable, Optional
+
+from utils import get_logger
+
+logger = get_logger()
+
+# операции на каждого получателя сообщения замеряются выборочно, раз в
+# SAMPLE_EVERY вызовов, чтобы метрики не заметно влияли на пропускную
+# способность рассылки
+SAMPLE_EVERY = 64
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    return f'{{{pairs}}}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, description: str, labels: dict[str, str]):
+        self.name: str = name
+        self.description: str = description
+        self.labels: dict[str, str] = labels
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str, labels: dict[str, str]):
+        super().__init__(name, description, labels)
+        self.value: float = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        return [(self.name, self.labels, self.value)]
+
+
+class Gauge(Metric):
+    """Текущее значение. Может вычисляться функцией в момент чтения
+    метрик, чтобы не тратить время в горячем пути."""
+
+    kind = 'gauge'
+
+    def __init__(self,
+                 name: str,
+                 description: str,
+                 labels: dict[str, str],
+                 func: Optional[Callable[[], float]] = None):
+        super().__init__(name, description, labels)
+        self.value: float = 0
+        self.func: Optional[Callable[[], float]] = func
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        value = self.func() if self.func else self.value
+        return [(self.name, self.labels, value)]
+
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными границами корзин: запись значения -
+    бинарный поиск корзины и три сложения."""
+
+    kind = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 description: str,
+                 labels: dict[str, str],
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets: tuple[float, ...] = buckets
+        self.counts: list[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        samples = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            cumulative += count
+            samples.append((f'{self.name}_bucket',
+                            {**self.labels, 'le': str(bound)},
+                            cumulative))
+        samples.append((f'{self.name}_sum', self.labels, self.sum))
+        samples.append((f'{self.name}_count', self.labels, self.count))
+        return samples
+
+
+class Registry:
+    """Набор метрик сервера с выводом в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self.metrics: dict[tuple, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        key = (metric.name, tuple(sorted(metric.labels.items())))
+        return self.metrics.setdefault(key, metric)
+
+    def counter(self, name: str, description: str, **labels: str) -> Counter:
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self,
+              name: str,
+              description: str,
+              func: Optional[Callable[[], float]] = None,
+              **labels: str
+              ) -> Gauge:
+        return self.register(Gauge(name, description, labels, func))
+
+    def histogram(self,
+                  name: str,
+                  description: str,
+                  **labels: str
+                  ) -> Histogram:
+        return self.register(Histogram(name, description, labels))
+
+    def render(self) -> str:
+        lines, described = [], set()
+        for metric in self.metrics.values():
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f'# HELP {metric.name} {metric.description}')
+                lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+async def watch_loop_lag(histogram: Histogram,
+                         gauge: Gauge,
+                         interval: float = 0.5
+                         ) -> None:
+    """Измерение задержки цикла событий: насколько позже запланированного
+    просыпается задача, спящая interval секунд."""
+
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+        histogram.observe(lag)
+        gauge.set(lag)
+
+
+class MetricsServer:
+    """Минимальный HTTP-сервер, отдающий метрики по GET /metrics."""
+
+    def __init__(self, registry: Registry, host: str, port: int):
+        self.registry: Registry = registry
+        self.host: str = host
+        self.port: int = port
+
+    async def handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            parts = request.decode(errors='replace').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and (
+                    parts[1].split('?')[0] == '/metrics'):
+                status = '200 OK'
+                body = self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not found.\n'
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: text/plain; version=0.0.4\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except Exception as error:
+            logger.error('Metrics request failed.', exc_info=error)
+        finally:
+            writer.close()
+
+    async def start(self) -> asyncio.AbstractServer:
+        instance = await asyncio.start_server(self.handle, self.host,
+                                              self.port)
+        logger.info('Metrics available at http://%s:%s/metrics',
+                    self.host, self.port)
+        return instance
@@ -1,60 +1,69 @@
+import time
 from datetime import datetime
+from sys import intern
 from typing import Optional
 from uuid import uuid4
 
 
 class Message:
+    """Сообщение истории. Хранит время публикации числом, логины и имя чата
+    интернированными строками, а отформатированный текст строит только при
+    первом обращении и кэширует его."""
+
+    __slots__ = ('id', 'login', 'body', 'recipient', 'chat_name',
+                 'is_private', 'timestamp', '_text')
 
     def __init__(self,
                  text: str,
                  login: str,
                  is_private: bool = False,
                  recipient: str = '',
-                 chat_name: str = ''):
-        self.is_private = is_private
-        self.login = login
-        self.pub_date = datetime.now()
-        self.recipient = recipient
-        self.chat_name = chat_name
-        self.text = self.format_message(text)
+                 chat_name: str = '',
+                 timestamp: Optional[float] = None):
+        self.id: int = 0
+        self.is_private: bool = is_private
+        self.login: str = intern(login)
+        self.timestamp: float = (
+            time.time() if timestamp is None else timestamp)
+        self.recipient: str = intern(recipient)
+        self.chat_name: str = intern(chat_name)
+        self.body: str = text
+        self._text: Optional[str] = None
+
+    @property
+    def pub_date(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp)
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.format_message(self.body)
+        return self._text
 
     def format_message(self, text: str) -> str:
-        pub_date = self.pub_date.strftime('%Y.%m.%d %H:%M:%S')
+        pub_date = time.strftime('%Y.%m.%d %H:%M:%S',
+                                 time.localtime(self.timestamp))
         private = 'in private ' if self.is_private else ''
         return f'{pub_date} {self.login} {private}says: {text}'
 
 
 class User:
+    __slots__ = ('login', 'password', 'addresses', 'logout_time',
+                 'private_chats')
 
     def __init__(self, login: str, password: str):
-        self.login: str = login
+        self.login: str = intern(login)
         self.password: str = password
         self.addresses: list[str] = []
         self.logout_time: Optional[datetime] = None
-        self.__count_sent_message: int = 0
-        self.__pub_date: Optional[datetime] = None
         self.private_chats: dict[str, str] = {}
 
-    @property
-    def count_sent_messages(self):
-        return self.__count_sent_message
-
-    @count_sent_messages.setter
-    def count_sent_messages(self, dt_now):
-        if (not self.__pub_date
-                or self.__pub_date.date() != dt_now.date()
-                or (self.__pub_date.date() == dt_now.date()
-                    and self.__pub_date.hour != dt_now.hour)):
-            self.__count_sent_message = 1
-        else:
-            self.__count_sent_message += 1
-        self.__pub_date = dt_now
-
 
 class Chat:
+    __slots__ = ('name', 'admin', 'users', '__private_keys')
 
     def __init__(self, name: str, admin: User):
-        self.name = name
+        self.name = intern(name)
         self.admin = admin
         self.users = []
         self.__private_keys = {}
@@ -63,3 +72,25 @@ class Chat:
         if login not in self.__private_keys:
             self.__private_keys[login] = uuid4().hex
         return self.__private_keys[login]
+
+    @property
+    def private_keys(self) -> dict[str, str]:
+        return dict(self.__private_keys)
+
+    def set_private_key(self, login: str, key: str) -> None:
+        self.__private_keys[login] = key
+
+
+class Session:
+    """Сессия, выданная после входа: по токену клиент входит повторно без
+    логина и пароля. last_id - последнее сообщение, отправленное клиенту
+    до отключения, resume_from - с какого сообщения продолжить рассылку
+    после повторного входа."""
+
+    __slots__ = ('login', 'expires', 'last_id', 'resume_from')
+
+    def __init__(self, login: str, expires: float, last_id: int = 0):
+        self.login: str = intern(login)
+        self.expires: float = expires
+        self.last_id: int = last_id
+        self.resume_from: Optional[int] = None
@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from metrics import Counter, Histogram, Registry
+from utils import get_logger
+
+logger = get_logger()
+
+SCHEME = 'scrypt'
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_SIZE = 16
+
+
+class HasherBusyError(Exception):
+    """Очередь на хеширование паролей переполнена."""
+
+
+def hash_password(password: str,
+                  n: int = SCRYPT_N,
+                  r: int = SCRYPT_R,
+                  p: int = SCRYPT_P
+                  ) -> str:
+    """Хеш пароля scrypt со случайной солью в виде
+    scrypt$n$r$p$соль$хеш."""
+
+    salt = os.urandom(SALT_SIZE)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p)
+    return f'{SCHEME}${n}${r}${p}${salt.hex()}${digest.hex()}'
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(f'{SCHEME}$')
+
+
+def check_password(password: str, stored: str) -> bool:
+    """Проверка пароля по сохранённому хешу. Значения без схемы - пароли
+    из журналов, записанных до перехода на хеши, они сравниваются как
+    есть."""
+
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode(), stored.encode())
+    _, n, r, p, salt, digest = stored.split('$')
+    candidate = hashlib.scrypt(password.encode(),
+                               salt=bytes.fromhex(salt),
+                               n=int(n),
+                               r=int(r),
+                               p=int(p))
+    return hmac.compare_digest(candidate.hex(), digest)
+
+
+class VerifiedCache:
+    """Кеш недавно проверенных паролей, чтобы вход с нескольких устройств
+    одного пользователя не запускал KDF повторно. Хранится не пароль, а его
+    HMAC с секретом процесса, ключ включает сохранённый хеш: смена пароля
+    делает запись недействительной."""
+
+    def __init__(self, ttl: float = 300.0, max_size: int = 10_000):
+        self.ttl: float = ttl
+        self.max_size: int = max_size
+        self.secret: bytes = os.urandom(32)
+        self.entries: dict[tuple[str, str], tuple[bytes, float]] = {}
+
+    def tag(self, password: str) -> bytes:
+        return hmac.digest(self.secret, password.encode(), 'sha256')
+
+    def check(self, login: str, password: str, stored: str) -> bool:
+        entry = self.entries.get((login, stored))
+        if entry is None:
+            return False
+        tag, expires = entry
+        if expires < time.monotonic():
+            del self.entries[(login, stored)]
+            return False
+        return hmac.compare_digest(tag, self.tag(password))
+
+    def add(self, login: str, password: str, stored: str) -> None:
+        self.entries.pop((login, stored), None)
+        if len(self.entries) >= self.max_size:
+            del self.entries[next(iter(self.entries))]
+        self.entries[(login, stored)] = (
+            self.tag(password), time.monotonic() + self.ttl)
+
+
+class PasswordHasher:
+    """Хеширование и проверка паролей в ограниченном пуле потоков
+    (hashlib.scrypt отпускает GIL), чтобы волна входов после перезапуска не
+    останавливала цикл событий. Одновременно выполняется не больше workers
+    операций, ожидать могут не больше max_pending, остальные отклоняются.
+    workers=0 выполняет хеширование прямо в цикле событий - только для
+    сравнения в бенчмарке."""
+
+    def __init__(self,
+                 workers: int = min(4, os.cpu_count() or 1),
+                 max_pending: int = 1000,
+                 cache: Optional[VerifiedCache] = None):
+        self.workers: int = workers
+        self.max_pending: int = max_pending
+        self.cache: VerifiedCache = cache or VerifiedCache()
+        self.executor: Optional[ThreadPoolExecutor] = (
+            ThreadPoolExecutor(workers, thread_name_prefix='password')
+            if workers else None)
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight: dict[tuple[str, str, bytes], asyncio.Future] = {}
+        self.pending: int = 0
+        self.running: int = 0
+        self.wait_timing: Optional[Histogram] = None
+        self.hash_timing: Optional[Histogram] = None
+        self.cache_hits: Optional[Counter] = None
+        self.rejected: Optional[Counter] = None
+
+    def register_metrics(self, registry: Registry) -> None:
+        registry.gauge(
+            'chat_password_pending', 'Password operations waiting for pool.',
+            lambda: self.pending)
+        registry.gauge(
+            'chat_password_running', 'Password operations in progress.',
+            lambda: self.running)
+        self.wait_timing = registry.histogram(
+            'chat_password_wait_seconds', 'Time waiting for password pool.')
+        self.hash_timing = registry.histogram(
+            'chat_password_hash_seconds', 'Time to hash or check a password.')
+        self.cache_hits = registry.counter(
+            'chat_password_cache_hits_total',
+            'Logins verified by the session cache.')
+        self.rejected = registry.counter(
+            'chat_password_rejected_total',
+            'Password operations rejected because the pool queue was full.')
+
+    async def run(self, func: Callable, *args: Any) -> Any:
+        if self.pending >= self.max_pending:
+            if self.rejected:
+                self.rejected.inc()
+            raise HasherBusyError('Password pool queue is full.')
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.workers or 1)
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.pending -= 1
+        self.running += 1
+        try:
+            if self.wait_timing:
+                self.wait_timing.observe(time.perf_counter() - started)
+            started = time.perf_counter()
+            if self.executor:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, func, *args)
+            else:
+                result = func(*args)
+            if self.hash_timing:
+                self.hash_timing.observe(time.perf_counter() - started)
+            return result
+        finally:
+            self.running -= 1
+            self.semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, login: str, password: str, stored: str) -> bool:
+        """Проверка пароля. Одновременные входы одного пользователя с тем
+        же паролем ждут одну проверку, повторные входы в течение ttl
+        проверяются по кешу без KDF."""
+
+        if self.cache.check(login, password, stored):
+            if self.cache_hits:
+                self.cache_hits.inc()
+            return True
+        key = (login, stored, self.cache.tag(password))
+        task = self.in_flight.get(key)
+        if task is not None:
+            if self.cache_hits:
+                self.cache_hits.inc()
+            return await asyncio.shield(task)
+        task = self.in_flight[key] = asyncio.ensure_future(
+            self.run(check_password, password, stored))
+        try:
+            verified = await asyncio.shield(task)
+        finally:
+            self.in_flight.pop(key, None)
+        if verified:
+            self.cache.add(login, password, stored)
+        return verified
+
+    def close(self) -> None:
+        if self.executor:
+            self.executor.shutdown(wait=False)
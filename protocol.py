@@ -0,0 +1,44 @@
+import asyncio
+from asyncio.streams import StreamReader
+
+from utils import LINE_END, MAX_LINE_LENGTH
+
+
+class FrameTooLongError(Exception):
+    """Строка протокола длиннее допустимого MAX_LINE_LENGTH."""
+
+
+def encode_line(text: str) -> bytes:
+    """Упаковка сообщения в кадр протокола: одна строка UTF-8 с переводом
+    строки в конце. Переводы строк внутри текста заменяются пробелами, чтобы
+    сообщение не распалось на несколько команд."""
+
+    return text.replace('\n', ' ').encode() + LINE_END
+
+
+async def discard_line(reader: StreamReader) -> None:
+    """Пропуск остатка слишком длинной строки до ближайшего разделителя."""
+
+    while True:
+        try:
+            await reader.readuntil(LINE_END)
+            return
+        except asyncio.LimitOverrunError as error:
+            await reader.readexactly(error.consumed)
+        except asyncio.IncompleteReadError:
+            return
+
+
+async def read_line(reader: StreamReader) -> bytes:
+    """Чтение одного кадра протокола. Возвращает пустые байты при закрытии
+    соединения. Лимит длины строки задаётся параметром limit у StreamReader,
+    строки длиннее лимита пропускаются целиком с FrameTooLongError."""
+
+    try:
+        return await reader.readuntil(LINE_END)
+    except asyncio.IncompleteReadError as error:
+        return error.partial
+    except asyncio.LimitOverrunError:
+        await discard_line(reader)
+        raise FrameTooLongError(
+            f'Line is longer than {MAX_LINE_LENGTH} bytes.')
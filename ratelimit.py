@@ -0,0 +1,112 @@
+import time
+from typing import Hashable, Optional
+
+from utils import SEND_PRIVATE_MESSAGE, SEND_TO_CHAT
+
+
+class Limit:
+    """Не более count событий за period секунд с равномерным
+    восстановлением. burst - размер допустимого всплеска, по умолчанию
+    равен count."""
+
+    __slots__ = ('count', 'period', 'burst')
+
+    def __init__(self, count: float, period: float, burst: float = 0):
+        if count <= 0 or period <= 0:
+            raise ValueError('Rate limit count and period must be positive.')
+        self.count: float = count
+        self.period: float = period
+        self.burst: float = burst or count
+
+    @property
+    def rate(self) -> float:
+        return self.count / self.period
+
+
+class TokenBucket:
+    """Корзина токенов: токены восстанавливаются со скоростью rate до
+    capacity, каждое событие забирает один токен. Проверка - несколько
+    арифметических операций без хранения истории событий."""
+
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens: float = capacity
+        self.updated: float = now
+
+    def consume(self, limit: Limit, now: float) -> bool:
+        self.tokens = min(limit.burst,
+                          self.tokens + (now - self.updated) * limit.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def is_full(self, limit: Limit, now: float) -> bool:
+        return self.tokens + (now - self.updated) * limit.rate >= limit.burst
+
+
+class RateLimiter:
+    """Набор корзин с общим ограничением, по одной на ключ (логин, IP или
+    один общий ключ). Полные корзины неотличимы от отсутствующих, поэтому
+    периодически удаляются, и память занимают только активные ключи."""
+
+    def __init__(self, limit: Limit):
+        self.limit: Limit = limit
+        self.buckets: dict[Hashable, TokenBucket] = {}
+        self.cleanup_size: int = 1024
+
+    def allow(self, key: Hashable = None) -> bool:
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.cleanup_size:
+                self.cleanup(now)
+            bucket = self.buckets[key] = TokenBucket(self.limit.burst, now)
+        return bucket.consume(self.limit, now)
+
+    def cleanup(self, now: float) -> None:
+        self.buckets = {
+            key: bucket for key, bucket in self.buckets.items()
+            if not bucket.is_full(self.limit, now)}
+        self.cleanup_size = max(1024, 2 * len(self.buckets))
+
+
+class RateLimits:
+    """Настройки ограничения частоты сервера. commands - ограничения
+    отдельных команд на пользователя, any_command - общее ограничение всех
+    команд пользователя, connections и connections_per_ip - новые
+    соединения, auth_per_ip - попытки регистрации и входа. None отключает
+    ограничение."""
+
+    def __init__(self,
+                 commands: Optional[dict[str, Limit]] = None,
+                 any_command: Optional[Limit] = Limit(20, 1, burst=50),
+                 connections: Optional[Limit] = Limit(500, 1, burst=1000),
+                 connections_per_ip: Optional[Limit] = Limit(20, 1,
+                                                             burst=100),
+                 auth_per_ip: Optional[Limit] = Limit(5, 1, burst=20)):
+        if commands is None:
+            commands = {SEND_PRIVATE_MESSAGE: Limit(5, 1, burst=20),
+                        SEND_TO_CHAT: Limit(5, 1, burst=20)}
+        self.commands: dict[str, Limit] = commands
+        self.any_command: Optional[Limit] = any_command
+        self.connections: Optional[Limit] = connections
+        self.connections_per_ip: Optional[Limit] = connections_per_ip
+        self.auth_per_ip: Optional[Limit] = auth_per_ip
+
+    @classmethod
+    def unlimited(cls) -> 'RateLimits':
+        return cls({}, None, None, None, None)
+
+
+def hourly(count: int) -> Limit:
+    """Ограничение сообщений в общий чат: count в час со скользящим
+    восстановлением вместо сброса на границе часа."""
+
+    return Limit(count, 3600)
+
+
+def make_limiter(limit: Optional[Limit]) -> Optional[RateLimiter]:
+    return RateLimiter(limit) if limit else None
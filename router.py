@@ -0,0 +1,143 @@
+import time
+from typing import Awaitable, Callable, Optional
+
+from metrics import Histogram, Registry
+from utils import get_logger
+
+logger = get_logger()
+
+UNKNOWN = 'unknown'
+
+
+class Route:
+    """Зарегистрированная команда: обработчик, число аргументов (последний
+    аргумент забирает остаток строки) и доступность только администраторам.
+    """
+
+    __slots__ = ('name', 'handler', 'nargs', 'admin')
+
+    def __init__(self,
+                 name: str,
+                 handler: 'Handler',
+                 nargs: int = 0,
+                 admin: bool = False):
+        self.name: str = name
+        self.handler: Handler = handler
+        self.nargs: int = nargs
+        self.admin: bool = admin
+
+
+class Command:
+    """Команда клиента, разобранная на имя и аргументы."""
+
+    __slots__ = ('name', 'args', 'text', 'login', 'address', 'route')
+
+    def __init__(self,
+                 text: str,
+                 login: str,
+                 address: str,
+                 route: Optional[Route] = None):
+        self.text: str = text
+        self.login: str = login
+        self.address: str = address
+        self.route: Optional[Route] = route
+        name, _, rest = text.partition(' ')
+        self.name: str = route.name if route else UNKNOWN
+        self.args: tuple[str, ...] = ()
+        if route and route.nargs:
+            args = rest.split(maxsplit=route.nargs - 1)
+            self.args = (*args, *[''] * (route.nargs - len(args)))
+
+
+Handler = Callable[[Command], Awaitable[None]]
+Middleware = Callable[[Command, Handler], Awaitable[None]]
+
+
+class CommandRouter:
+    """Реестр команд с диспетчеризацией по первому слову строки и цепочкой
+    middleware, через которую проходит каждая команда."""
+
+    def __init__(self, fallback: Handler):
+        self.routes: dict[str, Route] = {}
+        self.middlewares: list[Middleware] = []
+        self.fallback: Handler = fallback
+        self.chain: Handler = self.call_handler
+
+    def register(self,
+                 name: str,
+                 handler: Handler,
+                 nargs: int = 0,
+                 admin: bool = False
+                 ) -> None:
+        if name in self.routes:
+            raise ValueError(f'Command {name} is already registered.')
+        self.routes[name] = Route(name, handler, nargs, admin)
+
+    def use(self, middleware: Middleware) -> None:
+        """Добавление middleware. Первое добавленное выполняется первым."""
+
+        self.middlewares.append(middleware)
+        chain = self.call_handler
+        for item in reversed(self.middlewares):
+            chain = self.wrap(item, chain)
+        self.chain = chain
+
+    @staticmethod
+    def wrap(middleware: Middleware, call_next: Handler) -> Handler:
+        async def wrapped(command: Command) -> None:
+            await middleware(command, call_next)
+        return wrapped
+
+    def parse(self, text: str, login: str, address: str) -> Command:
+        route = self.routes.get(text.split(' ', 1)[0])
+        return Command(text, login, address, route)
+
+    async def call_handler(self, command: Command) -> None:
+        if command.route is None:
+            await self.fallback(command)
+            return
+        await command.route.handler(command)
+
+    async def dispatch(self, text: str, login: str, address: str) -> None:
+        await self.chain(self.parse(text, login, address))
+
+
+def error_isolation(reply: Callable[[str, str], Awaitable[None]]
+                    ) -> Middleware:
+    """Ошибка в обработчике не разрывает соединение клиента: она
+    логируется, а клиенту отправляется короткий ответ."""
+
+    async def middleware(command: Command, call_next: Handler) -> None:
+        try:
+            await call_next(command)
+        except Exception as error:
+            logger.error(
+                'Command %s from user %s failed.',
+                command.name,
+                command.login,
+                exc_info=error)
+            await reply(command.address, 'Command failed, please retry.')
+
+    return middleware
+
+
+def timing(registry: Registry) -> Middleware:
+    """Время выполнения каждой команды в гистограмме
+    chat_command_seconds{command=...}."""
+
+    histograms: dict[str, Histogram] = {}
+
+    async def middleware(command: Command, call_next: Handler) -> None:
+        started = time.perf_counter()
+        try:
+            await call_next(command)
+        finally:
+            histogram = histograms.get(command.name)
+            if histogram is None:
+                histogram = histograms[command.name] = registry.histogram(
+                    'chat_command_seconds',
+                    'Command processing time.',
+                    command=command.name)
+            histogram.observe(time.perf_counter() - started)
+
+    return middleware
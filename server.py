@@ -1,14 +1,28 @@
 import asyncio
+import hashlib
+import secrets
+import time
 from asyncio.streams import StreamReader, StreamWriter
+from collections import Counter
 from datetime import datetime
-
-from models import Chat, Message, User
-from utils import (AUTH, AUTH_OR_LOGIN, BYTES, CREATE_CHAT, EXIT, GENERAL_CHAT,
-                   HOST, INPUT_LOGIN, INPUT_PASSWORD, INVITE_TO_CHAT,
-                   JOIN_TO_CHAT, LOGIN, LOGIN_SET, LOGIN_SUCCESSFUL, PORT,
-                   SEND_MESSAGE, SEND_PRIVATE_MESSAGE, SEND_TO_CHAT,
-                   SHOW_UNREAD_MESSAGES, USER_STATUS, get_logger,
-                   get_split_values)
+from typing import Any, Iterable, Optional
+
+from broker import BrokerLink
+from connection import POLICIES, Connection, OutboundLimits
+from history import GENERAL_CHANNEL, History, chat_channel
+from journal import Journal
+from metrics import SAMPLE_EVERY, MetricsServer, Registry, watch_loop_lag
+from models import Chat, Message, Session, User
+from passwords import HasherBusyError, PasswordHasher, is_hashed
+from protocol import FrameTooLongError, encode_line, read_line
+from ratelimit import RateLimiter, RateLimits, hourly, make_limiter
+from router import Command, CommandRouter, Handler, error_isolation, timing
+from utils import (AUTH, AUTH_OR_LOGIN, CREATE_CHAT, EXIT, GENERAL_CHAT, HOST,
+                   INPUT_LOGIN, INPUT_PASSWORD, INVALID_SESSION,
+                   INVITE_TO_CHAT, JOIN_TO_CHAT, JOURNAL_DIR, LOGIN, LOGIN_SET,
+                   LOGIN_SUCCESSFUL, MAX_LINE_LENGTH, METRICS, PORT, RESUME,
+                   RESUME_TOKEN, SEND_MESSAGE, SEND_PRIVATE_MESSAGE,
+                   SEND_TO_CHAT, SHOW_UNREAD_MESSAGES, USER_STATUS, get_logger)
 
 logger = get_logger()
 
@@ -19,7 +33,16 @@ class Server:
                  host: str = HOST,
                  port: int = PORT,
                  short_history_depth: int = 20,
-                 sent_message_per_user: int = 20
+                 sent_message_per_user: int = 20,
+                 outbound_limits: Optional[OutboundLimits] = None,
+                 journal_dir: Optional[str] = None,
+                 reuse_port: bool = False,
+                 metrics_port: Optional[int] = None,
+                 admins: Iterable[str] = (),
+                 rate_limits: Optional[RateLimits] = None,
+                 password_hasher: Optional[PasswordHasher] = None,
+                 session_ttl: float = 7 * 24 * 3600,
+                 resume_depth: int = 1000
                  ):
 
         self.event_loop: asyncio.AbstractEventLoop = event_loop  # для тестов
@@ -27,54 +50,285 @@ class Server:
         self.port: int = port
         self.short_history_depth: int = short_history_depth
         self.sent_message_per_user: int = sent_message_per_user
-        self.connections: dict[str, tuple[StreamReader, StreamWriter]] = {}
+        self.outbound_limits: OutboundLimits = (
+            outbound_limits or OutboundLimits())
+        self.rate_limits: RateLimits = rate_limits or RateLimits()
+        self.hasher: PasswordHasher = password_hasher or PasswordHasher()
+        commands = {SEND_MESSAGE: hourly(sent_message_per_user),
+                    **self.rate_limits.commands}
+        self.command_limiters: dict[str, RateLimiter] = {
+            command: RateLimiter(limit) for command, limit in commands.items()}
+        self.user_limiter: Optional[RateLimiter] = make_limiter(
+            self.rate_limits.any_command)
+        self.connection_limiter: Optional[RateLimiter] = make_limiter(
+            self.rate_limits.connections)
+        self.ip_connection_limiter: Optional[RateLimiter] = make_limiter(
+            self.rate_limits.connections_per_ip)
+        self.auth_limiter: Optional[RateLimiter] = make_limiter(
+            self.rate_limits.auth_per_ip)
+        self.overflow_stats: Counter = Counter()
+        self.connections: dict[str, Connection] = {}
         self.users: dict[str, User] = {}
-        self.history: list[Message] = []
+        self.history: History = History()
         self.chats: dict[str, Chat] = {}
-
-    async def write_to_client(self,
-                              address: str,
-                              message: str,
-                              line_break: bool = True
-                              ) -> None:
-        """Отправка сообщения клиенту."""
+        self.session_ttl: float = session_ttl
+        self.resume_depth: int = resume_depth
+        self.sessions: dict[str, Session] = {}
+        self.address_sessions: dict[str, str] = {}
+        self.journal: Optional[Journal] = (
+            Journal(journal_dir) if journal_dir else None)
+        self.reuse_port: bool = reuse_port
+        self.broker: Optional[BrokerLink] = None
+        self.restore_handlers = {
+            'user': self.restore_user,
+            'password': self.restore_password,
+            'session': self.restore_session,
+            'chat': self.restore_chat,
+            'invite': self.restore_invite,
+            'join': self.restore_join,
+            'message': self.restore_message,
+        }
+        self.admins: set[str] = set(admins)
+        self.metrics_port: Optional[int] = metrics_port
+        self.metrics: Registry = Registry()
+        self.register_metrics()
+        self.router: CommandRouter = CommandRouter(self.wrong_command)
+        self.register_commands()
+
+    def register_metrics(self) -> None:
+        """Регистрация метрик сервера. Значения, которые дорого поддерживать
+        в горячем пути, вычисляются функциями в момент чтения метрик."""
+
+        registry = self.metrics
+        self.connections_total = registry.counter(
+            'chat_connections_total', 'Accepted client connections.')
+        registry.gauge(
+            'chat_connections_open', 'Open client connections.',
+            lambda: len(self.connections))
+        registry.gauge(
+            'chat_history_messages', 'Messages stored in history.',
+            lambda: len(self.history))
+        registry.gauge(
+            'chat_outbound_queue_depth',
+            'Messages waiting in all outbound queues.',
+            lambda: sum(connection.queue.qsize()
+                        for connection in self.connections.values()))
+        registry.gauge(
+            'chat_outbound_queue_max_depth',
+            'Largest outbound queue of a single connection.',
+            lambda: max((connection.queue.qsize()
+                         for connection in self.connections.values()),
+                        default=0))
+        for action in POLICIES:
+            registry.gauge(
+                'chat_outbound_overflow_actions',
+                'Slow-consumer policy actions applied.',
+                lambda action=action: self.overflow_stats[action],
+                action=action)
+        self.writes_count = 0
+        self.write_timing = registry.histogram(
+            'chat_write_to_client_seconds',
+            f'Time spent in write_to_client, 1 of {SAMPLE_EVERY} calls.')
+        self.socket_write_timing = registry.histogram(
+            'chat_socket_write_seconds',
+            f'Time to write and drain one outbound message, '
+            f'1 of {SAMPLE_EVERY} writes.')
+        self.hasher.register_metrics(registry)
+        self.rate_limited = {
+            kind: registry.counter(
+                'chat_rate_limited_total',
+                'Requests rejected by rate limits.',
+                kind=kind)
+            for kind in ('connection', 'auth', 'command')}
+        self.loop_lag = registry.histogram(
+            'chat_event_loop_lag_seconds', 'Event loop lag.')
+        self.loop_lag_last = registry.gauge(
+            'chat_event_loop_lag_last_seconds', 'Last measured loop lag.')
+
+    async def save(self, op: str, **fields: Any) -> None:
+        """Запись операции в журнал и ожидание её фиксации на диске.
+        Вызывается сразу после изменения состояния, без промежуточных await,
+        чтобы снимок состояния и журнал не расходились."""
+
+        if self.broker:
+            self.broker.publish({'op': op, **fields})
+        if self.journal:
+            await self.journal.append(op, **fields)
+
+    async def notify(self, login: str, text: str) -> None:
+        """Уведомление всех подключений пользователя, в том числе
+        подключённых к другим воркерам."""
+
+        for adr in self.users[login].addresses:
+            await self.write_to_client(adr, text)
+        if self.broker:
+            self.broker.publish({'op': 'notify', 'login': login, 'text': text})
+
+    async def apply_remote(self, record: dict) -> None:
+        """Применение операции, выполненной другим воркером: изменение
+        состояния, запись в журнал и доставка локальным получателям."""
+
+        op = record.pop('op')
+        if op == 'notify':
+            user = self.users.get(record['login'])
+            for adr in user.addresses if user else []:
+                await self.write_to_client(adr, record['text'])
+            return
+        if (op == 'user' and record['login'] in self.users
+                or op == 'chat' and record['name'] in self.chats):
+            logger.warning('Conflicting %s record from broker skipped.', op)
+            return
+        result = self.restore_handlers[op](record)
+        if self.journal:
+            self.journal.append(op, **record)
+        if op == 'message':
+            await self.deliver_message(result)
+
+    async def save_message(self, message: Message) -> None:
+        await self.save(
+            'message',
+            login=message.login,
+            text=message.body,
+            is_private=message.is_private,
+            recipient=message.recipient,
+            chat_name=message.chat_name,
+            pub_date=message.timestamp)
+
+    def dump_state(self) -> dict:
+        """Сериализация пользователей, чатов и истории для снимка."""
+
+        return {
+            'users': [
+                {'login': user.login,
+                 'password': user.password,
+                 'private_chats': user.private_chats}
+                for user in self.users.values()],
+            'chats': [
+                {'name': chat.name,
+                 'admin': chat.admin.login,
+                 'users': [user.login for user in chat.users],
+                 'keys': chat.private_keys}
+                for chat in self.chats.values()],
+            'messages': [
+                {'login': msg.login,
+                 'text': msg.body,
+                 'is_private': msg.is_private,
+                 'recipient': msg.recipient,
+                 'chat_name': msg.chat_name,
+                 'pub_date': msg.timestamp}
+                for msg in self.history.messages()],
+            'sessions': [
+                {'key': key,
+                 'login': session.login,
+                 'expires': session.expires,
+                 'last_id': session.last_id}
+                for key, session in self.sessions.items()
+                if session.expires > time.time()],
+        }
+
+    def load_state(self, state: dict) -> None:
+        for data in state['users']:
+            self.restore_user(data)
+            self.users[data['login']].private_chats.update(
+                data['private_chats'])
+        for data in state['chats']:
+            self.restore_chat(data)
+            chat = self.chats[data['name']]
+            chat.users = [self.users[login] for login in data['users']]
+            for login, key in data['keys'].items():
+                chat.set_private_key(login, key)
+        for data in state['messages']:
+            self.restore_message(data)
+        for data in state.get('sessions', ()):
+            self.restore_session(data)
+
+    def restore_user(self, record: dict) -> None:
+        self.users[record['login']] = User(record['login'], record['password'])
+
+    def restore_password(self, record: dict) -> None:
+        self.users[record['login']].password = record['password']
+
+    def restore_session(self, record: dict) -> None:
+        self.sessions[record['key']] = Session(
+            record['login'], record['expires'], record['last_id'])
+
+    def restore_chat(self, record: dict) -> None:
+        admin = self.users[record['admin']]
+        chat = Chat(record['name'], admin=admin)
+        chat.users.append(admin)
+        self.chats[chat.name] = chat
+
+    def restore_invite(self, record: dict) -> None:
+        self.chats[record['chat']].set_private_key(
+            record['login'], record['key'])
+        self.users[record['login']].private_chats[record['chat']] = (
+            record['key'])
+
+    def restore_join(self, record: dict) -> None:
+        self.chats[record['chat']].users.append(self.users[record['login']])
+
+    def restore_message(self, record: dict) -> Message:
+        return self.history.append(Message(
+            record['text'],
+            record['login'],
+            is_private=record['is_private'],
+            recipient=record['recipient'],
+            chat_name=record['chat_name'],
+            timestamp=record['pub_date']))
+
+    def restore(self) -> None:
+        """Восстановление состояния из снимка и хвоста журнала."""
+
+        snapshot, records = self.journal.recover()
+        if snapshot:
+            self.load_state(snapshot)
+        count = 0
+        for record in records:
+            self.restore_handlers[record['op']](record)
+            count += 1
+        logger.info(
+            'State restored: %s users, %s chats, %s messages, '
+            '%s journal records replayed.',
+            len(self.users), len(self.chats), len(self.history), count)
+
+    async def write_to_client(self, address: str, message: str) -> None:
+        """Постановка сообщения в очередь отправки клиенту. Каждое сообщение
+        уходит отдельной строкой протокола. Не ждёт фактической отправки:
+        очередь разбирает задача-писатель соединения."""
 
         connection = self.connections.get(address)
         if not connection:
             return
-        writer = connection[1]
-        message += '\n' if line_break else ''
-        writer.write(message.encode())
-        try:
-            await writer.drain()
-        except Exception as error:
-            logger.error(error)
-            try:
-                writer.close()
-                await writer.wait_closed()
-            except Exception as error:
-                logger.error(
-                    'Error when closing the client connection.',
-                    exc_info=error)
-        else:
-            await asyncio.sleep(0.1)
+        self.writes_count += 1
+        if self.writes_count % SAMPLE_EVERY:
+            connection.put(encode_line(message))
+            return
+        started = time.perf_counter()
+        connection.put(encode_line(message))
+        self.write_timing.observe(time.perf_counter() - started)
 
     async def read_from_client(self, address: str) -> str:
-        """Чтение сообщения от клиента."""
+        """Чтение одной команды клиента. Пустые строки пропускаются, поэтому
+        пустой результат означает закрытие соединения."""
 
         connection = self.connections.get(address)
         if not connection:
             return ''
-        answer, reader = '', connection[0]
-        try:
-            data = await reader.read(BYTES)
+        while True:
+            try:
+                data = await read_line(connection.reader)
+            except FrameTooLongError as error:
+                await self.write_to_client(address, str(error))
+                continue
+            except Exception as error:
+                logger.error(error)
+                return ''
             if not data:
                 logger.error("Can't read message from client %s", address)
-                return answer
-            return data.decode().strip()
-        except Exception as error:
-            logger.error(error)
-            return answer
+                return ''
+            message = data.decode(errors='replace').strip()
+            if message:
+                return message
 
     async def get_auth_data(self,
                             address: str,
@@ -84,20 +338,18 @@ class Server:
 
         login, password = '', ''
         while True:
-            await self.write_to_client(address, INPUT_LOGIN, line_break=False)
+            await self.write_to_client(address, INPUT_LOGIN)
             login = await self.read_from_client(address)
-            if login:
-                if new_user and login in self.users:
-                    await self.write_to_client(
-                        address,
-                        'The login is taken. Input another login.')
-                    continue
+            if not login:
+                break
+            if new_user and login in self.users:
                 await self.write_to_client(
                     address,
-                    INPUT_PASSWORD,
-                    line_break=False)
-                password = await self.read_from_client(address)
-                break
+                    'The login is taken. Input another login.')
+                continue
+            await self.write_to_client(address, INPUT_PASSWORD)
+            password = await self.read_from_client(address)
+            break
         return login, password
 
     async def create_user(self, address: str) -> str:
@@ -105,11 +357,21 @@ class Server:
 
         while True:
             login, password = await self.get_auth_data(address, new_user=True)
+            if not login or not password:
+                return ''
+            password = await self.hasher.hash(password)
+            if login in self.users:
+                await self.write_to_client(
+                    address,
+                    'The login is taken. Input another login.')
+                continue
             await self.write_to_client(address, LOGIN_SET)
             user_obj = User(login, password)
             user_obj.addresses.append(address)
             self.users[login] = user_obj
+            await self.save('user', login=login, password=password)
             logger.info('Create user %s', login)
+            await self.issue_session(login, address)
             break
         return login
 
@@ -124,45 +386,144 @@ class Server:
                 await self.write_to_client(address, 'User not found.')
                 return ''
             user = self.users[login]
-            if password != user.password:
+            if not await self.hasher.verify(login, password, user.password):
                 await self.write_to_client(address, 'Wrong password.')
                 return ''
             is_authorized = True
+            if not is_hashed(user.password):
+                user.password = await self.hasher.hash(password)
+                await self.save(
+                    'password', login=login, password=user.password)
             if address not in user.addresses:
                 user.addresses.append(address)
             logger.info('Logging user %s', login)
             await self.write_to_client(address, LOGIN_SUCCESSFUL)
+            await self.issue_session(login, address)
         return login
 
+    async def issue_session(self, login: str, address: str) -> None:
+        """Выдача токена для повторного входа без логина и пароля. Сервер
+        хранит только хеш токена."""
+
+        token = secrets.token_urlsafe(24)
+        key = hashlib.sha256(token.encode()).hexdigest()
+        session = Session(login,
+                          time.time() + self.session_ttl,
+                          self.history.last_id)
+        self.sessions[key] = session
+        self.address_sessions[address] = key
+        await self.save('session', key=key, login=login,
+                        expires=session.expires, last_id=session.last_id)
+        await self.write_to_client(address, f'{RESUME_TOKEN}{token}')
+
+    async def resume_session(self, address: str, answer: str) -> str:
+        """Вход по токену сессии за один запрос: /resume <token> [last_id].
+        После входа клиент получает сообщения, пропущенные после last_id или
+        после последнего сообщения, отправленного ему до отключения."""
+
+        args = answer.split()[1:]
+        key = hashlib.sha256(args[0].encode()).hexdigest() if args else ''
+        session = self.sessions.get(key)
+        if session and session.expires < time.time():
+            del self.sessions[key]
+            session = None
+        if session is None or session.login not in self.users:
+            await self.write_to_client(address, INVALID_SESSION)
+            return ''
+        last_id = args[1] if len(args) > 1 else ''
+        session.resume_from = (
+            int(last_id) if last_id.isdigit() else session.last_id)
+        self.address_sessions[address] = key
+        self.users[session.login].addresses.append(address)
+        logger.info('Session of user %s resumed.', session.login)
+        await self.write_to_client(address, LOGIN_SUCCESSFUL)
+        return session.login
+
+    def user_channels(self, login: str) -> list[str]:
+        """Каналы, сообщения которых видит пользователь: общий чат, личная
+        переписка и приватные чаты, в которых он состоит."""
+
+        user = self.users[login]
+        channels = [GENERAL_CHANNEL, *self.history.private_channels[login]]
+        channels.extend(chat_channel(chat.name) for chat in self.chats.values()
+                        if user in chat.users)
+        return channels
+
+    def allow_auth(self, address: str) -> bool:
+        """Ограничение попыток регистрации и входа с одного IP."""
+
+        ip = address.rpartition(':')[0]
+        if self.auth_limiter and not self.auth_limiter.allow(ip):
+            self.rate_limited['auth'].inc()
+            logger.warning('Too many login attempts from %s.', ip)
+            return False
+        return True
+
+    def allow_connection(self, ip: str) -> bool:
+        """Ограничение частоты новых соединений: общее и с одного IP."""
+
+        if (self.connection_limiter and not self.connection_limiter.allow()
+                or self.ip_connection_limiter
+                and not self.ip_connection_limiter.allow(ip)):
+            self.rate_limited['connection'].inc()
+            logger.warning('Connection from %s rejected by rate limit.', ip)
+            return False
+        return True
+
     async def user_authorization(self, address: str) -> str:
         """Обработка запроса на авторизацию пользователя."""
 
         while True:
             await self.write_to_client(address, AUTH_OR_LOGIN)
             answer = await self.read_from_client(address)
-            if answer == AUTH:
-                login = await self.create_user(address)
+            if answer == '':
+                login = answer
                 break
-            elif answer == LOGIN:
-                login = await self.login_user(address)
-                if login:
+            elif answer not in (AUTH, LOGIN) and (
+                    answer.split(' ', 1)[0] != RESUME):
+                await self.write_to_client(
+                    address,
+                    'Command unknown, please repeat.')
+                continue
+            elif not self.allow_auth(address):
+                await self.write_to_client(
+                    address,
+                    'Too many login attempts, try again later.')
+                continue
+            try:
+                if answer == AUTH:
+                    login = await self.create_user(address)
                     break
+                elif answer == LOGIN:
+                    login = await self.login_user(address)
+                else:
+                    login = await self.resume_session(address, answer)
+            except HasherBusyError:
+                await self.write_to_client(
+                    address,
+                    'Server is busy, try again later.')
                 continue
-            elif answer == '':
-                login = answer
+            if login:
                 break
-            await self.write_to_client(
-                address,
-                'Command unknown, please repeat.')
         return login
 
     async def send_short_history(self, address: str) -> None:
         """Отправка краткой истории в количестве self.short_history_depth
-        сообщений при входе пользователя в общий чат."""
+        сообщений при входе пользователя в общий чат. После входа по токену
+        вместо неё отправляются все пропущенные сообщения пользователя, но
+        не больше self.resume_depth последних."""
 
         await self.write_to_client(address, GENERAL_CHAT)
-        public_messages = [msg for msg in self.history if not msg.is_private]
-        for msg in public_messages[-self.short_history_depth:]:
+        session = self.sessions.get(self.address_sessions.get(address, ''))
+        if session and session.resume_from is not None:
+            messages = list(self.history.after(
+                self.user_channels(session.login), session.resume_from))
+            session.resume_from = None
+            for msg in messages[-self.resume_depth:]:
+                await self.write_to_client(address, msg.text)
+            return
+        for msg in self.history.tail(GENERAL_CHANNEL,
+                                     self.short_history_depth):
             await self.write_to_client(address, msg.text)
 
     async def close_client_connection(self, address: str, login: str) -> None:
@@ -171,96 +532,105 @@ class Server:
 
         connection = self.connections.get(address)
         if connection:
-            writer = connection[1]
             await self.write_to_client(
                 address,
                 'You are disconnected from chat. Have a nice day.')
             logger.info('User %s at %s disconnected.', login, address)
-            del connection
             user = self.users[login]
             user.addresses.remove(address)
             user.logout_time = datetime.now()
-            try:
-                writer.close()
-                await writer.wait_closed()
-            except Exception as error:
-                logger.error(
-                    'Error when closing writer %s %s.',
-                    address,
-                    error)
+            await self.close_session(address)
+            await connection.close()
+            del connection
+
+    async def close_session(self, address: str) -> None:
+        """Запоминание последнего сообщения, отправленного клиенту, чтобы
+        при повторном входе по токену продолжить с него."""
 
-    async def send_private(self,
-                           message,
-                           cur_login: str,
-                           address: str
-                           ) -> None:
+        key = self.address_sessions.pop(address, '')
+        session = self.sessions.get(key)
+        if session is None:
+            return
+        session.last_id = self.history.last_id
+        await self.save('session',
+                        key=key,
+                        login=session.login,
+                        expires=session.expires,
+                        last_id=session.last_id)
+
+    async def deliver_message(self,
+                              message: Message,
+                              address: str = ''
+                              ) -> None:
+        """Рассылка сообщения получателям, подключённым к этому серверу.
+        Соединение отправителя видит себя в сообщении как me."""
+
+        if message.chat_name:
+            chat = self.chats[message.chat_name]
+            addresses = [adr for user in chat.users for adr in user.addresses]
+        elif message.is_private:
+            recipient = self.users.get(message.recipient)
+            addresses = recipient.addresses if recipient else []
+        else:
+            addresses = list(self.connections)
+        text = message.text
+        for adr in addresses:
+            if adr == address:
+                await self.write_to_client(
+                    adr,
+                    text.replace(f' {message.login} ', ' me ', 1))
+            else:
+                await self.write_to_client(adr, text)
+
+    async def send_private(self, command: Command) -> None:
         """Обработка запроса на отправку приватного сообщения другому
         пользователю."""
 
-        message = message.replace(SEND_PRIVATE_MESSAGE, '').strip()
-        login, text = message.split(maxsplit=1)
+        cur_login, address = command.login, command.address
+        login, text = command.args
+        if login not in self.users:
+            await self.write_to_client(address, 'Wrong user login.')
+            return
+        if not text:
+            await self.write_to_client(
+                address,
+                'Message text can not be empty.')
+            return
         message_obj = Message(
             text,
             cur_login,
             is_private=True,
             recipient=login)
         self.history.append(message_obj)
-        text = message_obj.text
-        user = self.users[login]
-        if (login in self.users
-                and login == cur_login
-                and address in user.addresses):
-            text.replace(f' {login} ', ' me ')
-            await self.write_to_client(address, text)
-        elif login in self.users and login != cur_login:
-            for adr in user.addresses:
-                await self.write_to_client(adr, text)
-        else:
-            await self.write_to_client(address, 'Wrong user login.')
+        await self.save_message(message_obj)
+        await self.deliver_message(message_obj, address)
 
-    async def send(self, message: str, login: str, address: str) -> None:
+    async def send(self, command: Command) -> None:
         """Обработка запроса на отправку сообщения в общий чат."""
 
-        text = message.replace(SEND_MESSAGE, '').strip()
-        message_obj = Message(text, login)
-        text = message_obj.text
-        user = self.users[login]
-        if user.count_sent_messages == self.sent_message_per_user:
-            for adr in user.addresses:
-                await self.write_to_client(
-                    adr, (f'Sorry, but you have reached your limit '
-                          f'of {self.sent_message_per_user} per hour. '
-                          f'The message not be sent.'))
-            return
+        message_obj = Message(command.args[0], command.login)
         self.history.append(message_obj)
-        user.count_sent_messages = datetime.now()
-        for adr in self.connections:
-            if adr == address:
-                text = text.replace(f' {login} ', ' me ')
-            await self.write_to_client(adr, text)
+        await self.save_message(message_obj)
+        await self.deliver_message(message_obj, command.address)
 
-    async def show_unread(self, login: str, address: str) -> None:
+    async def show_unread(self, command: Command) -> None:
         """Обработка запроса на вывод всех непрочитанных сообщений
         с момента последнего выхода из общего чата."""
 
+        login, address = command.login, command.address
         user = self.users[login]
         if not user.logout_time:
             return
-        unread = [msg for msg in self.history
-                  if msg.pub_date > user.logout_time]
-        for message in unread:
-            if message.is_private and message.login != login:
-                continue
+        channels = self.user_channels(login)
+        for message in self.history.since(channels,
+                                          user.logout_time.timestamp()):
             await self.write_to_client(address, message.text)
 
-    async def create_chat(self,
-                          message: str,
-                          login: str,
-                          address: str
-                          ) -> None:
+    async def create_chat(self, command: Command) -> None:
         """Обработка запроса на создание приватного чата."""
 
-        chat_name = message.replace(CREATE_CHAT, '').strip()
+        login, address = command.login, command.address
+        chat_name = command.args[0]
         if not chat_name:
             await self.write_to_client(address, 'Chat name can not be empty.')
         elif chat_name in self.chats:
@@ -273,20 +643,20 @@ class Server:
             chat_obj.admin = user
             chat_obj.users.append(user)
             self.chats[chat_name] = chat_obj
+            await self.save('chat', name=chat_name, admin=login)
             await self.write_to_client(address, f'Chat {chat_name} created.')
 
-    async def show_status(self, login: str, address: str) -> None:
+    async def show_status(self, command: Command) -> None:
         """Обработка запроса о статусе пользователя: вывод адресов, количество
          приватных сообщения, администрирование приватных чатов, участие в
          приватных чатах и инвайт-ключи к ним."""
 
+        login, address = command.login, command.address
         user = self.users[login]
         await self.write_to_client(address, f'Your address is {address}.')
-        private_messages = [msg for msg in self.history
-                            if msg.is_private and msg.login == login]
         await self.write_to_client(
             address,
-            f'You have {len(private_messages)} private messages.')
+            f'You have {self.history.count_private(login)} private messages.')
         admin_of_chats = [chat for chat in self.chats.values()
                           if user == chat.admin]
         await self.write_to_client(
@@ -297,20 +667,16 @@ class Server:
         await self.write_to_client(
             address,
             f'You are member of {len(amount_chats)} private chats.')
-        for k, v in user.private_chats:
+        for k, v in user.private_chats.items():
             await self.write_to_client(
                 address,
                 f'The invite key for the chat {k} is {v}.')
 
-    async def send_to_chat(self,
-                           message: str,
-                           login: str,
-                           address: str
-                           ) -> None:
+    async def send_to_chat(self, command: Command) -> None:
         """Отправка сообщения в приватный чат."""
 
-        message = message.replace(SEND_TO_CHAT, '').strip()
-        chat_name, text = get_split_values(message)
+        login, address = command.login, command.address
+        chat_name, text = command.args
         if chat_name not in self.chats:
             await self.write_to_client(
                 address,
@@ -333,23 +699,14 @@ class Server:
             is_private=True,
             chat_name=chat_name)
         self.history.append(message_obj)
-        addresses = []
-        for user in chat.users:
-            addresses.extend(user.addresses)
-        for adr in addresses:
-            if adr == address:
-                text.replace(f' {login} ', ' me ')
-            await self.write_to_client(adr, message_obj.text)
-
-    async def invite_user_to_chat(self,
-                                  message: str,
-                                  curr_login: str,
-                                  address: str
-                                  ) -> None:
+        await self.save_message(message_obj)
+        await self.deliver_message(message_obj, address)
+
+    async def invite_user_to_chat(self, command: Command) -> None:
         """Обработка запроса на приглашение пользователя в приватный чат."""
 
-        message = message.replace(INVITE_TO_CHAT, '').strip()
-        login, chat_name = get_split_values(message)
+        curr_login, address = command.login, command.address
+        login, chat_name = command.args
         if not login or not chat_name:
             await self.write_to_client(address, 'Wrong commands parameters.')
             return
@@ -380,24 +737,20 @@ class Server:
             f'{chat_name} has been sent.')
         invite_key = chat.get_private_key(login)
         user.private_chats[chat_name] = invite_key
-        for adr in user.addresses:
-            await self.write_to_client(
-                adr,
-                f'You are invited to the chat {chat_name} by an admin '
-                f'{curr_login}. Your invite key is {invite_key}')
-
-    async def join_to_chat(self,
-                           message: str,
-                           login: str,
-                           address: str
-                           ) -> None:
+        await self.save('invite', chat=chat_name, login=login, key=invite_key)
+        await self.notify(
+            login,
+            f'You are invited to the chat {chat_name} by an admin '
+            f'{curr_login}. Your invite key is {invite_key}')
+
+    async def join_to_chat(self, command: Command) -> None:
         """Обработка запроса на присоединение пользователя к приватному чату.
         Если у пользователя нет токена, будет отправлен запрос администратору
         чата. Если токен есть и он валиден, пользователь присоединяется к
         чату."""
 
-        message = message.replace(JOIN_TO_CHAT, '').strip()
-        chat_name, invite_key = get_split_values(message)
+        login, address = command.login, command.address
+        chat_name, invite_key = command.args
         if not chat_name:
             await self.write_to_client(
                 address,
@@ -427,14 +780,11 @@ class Server:
                     await self.write_to_client(
                         address,
                         'A request has been sent to the admin.')
-                    for adr in admin.addresses:
-                        await self.write_to_client(
-                            adr,
-                            f'User {login} wants to join the chat '
-                            f'{chat_name}.',
-                            line_break=True)
+                    await self.notify(
+                        admin.login,
+                        f'User {login} wants to join the chat {chat_name}.')
                     return
-                elif answer == 'n':
+                elif answer in ('n', ''):
                     return
                 else:
                     await self.write_to_client(
@@ -445,37 +795,87 @@ class Server:
                 address,
                 'The invite-key is invalid.')
             return
+        chat.users.append(user)
+        await self.save('join', chat=chat_name, login=login)
         await self.write_to_client(
             address,
             f'You are join to chat {chat_name}.')
-        chat.users.append(user)
+
+    async def show_metrics(self, command: Command) -> None:
+        """Вывод метрик сервера администратору."""
+
+        for line in self.metrics.render().splitlines():
+            if not line.startswith('#'):
+                await self.write_to_client(command.address, line)
+
+    async def wrong_command(self, command: Command) -> None:
+        await self.write_to_client(command.address, 'Wrong command.')
+
+    def register_commands(self) -> None:
+        """Регистрация команд чата и цепочки middleware: изоляция ошибок,
+        ограничение частоты, замер времени, проверка прав."""
+
+        router = self.router
+        router.register(SHOW_UNREAD_MESSAGES, self.show_unread)
+        router.register(USER_STATUS, self.show_status)
+        router.register(METRICS, self.show_metrics, admin=True)
+        router.register(SEND_MESSAGE, self.send, nargs=1)
+        router.register(SEND_PRIVATE_MESSAGE, self.send_private, nargs=2)
+        router.register(SEND_TO_CHAT, self.send_to_chat, nargs=2)
+        router.register(CREATE_CHAT, self.create_chat, nargs=1)
+        router.register(INVITE_TO_CHAT, self.invite_user_to_chat, nargs=2)
+        router.register(JOIN_TO_CHAT, self.join_to_chat, nargs=2)
+        router.use(error_isolation(self.write_to_client))
+        router.use(self.limit_rate)
+        router.use(timing(self.metrics))
+        router.use(self.check_permissions)
+
+    async def check_permissions(self,
+                                command: Command,
+                                call_next: Handler
+                                ) -> None:
+        """Команды администраторов доступны только логинам из self.admins.
+        """
+
+        if command.route and command.route.admin and (
+                command.login not in self.admins):
+            await self.write_to_client(command.address, 'Permission denied.')
+            return
+        await call_next(command)
+
+    async def limit_rate(self, command: Command, call_next: Handler) -> None:
+        """Ограничение частоты команд пользователя: общее и по отдельным
+        командам. Проверка выполняется первой, поэтому отклонённая команда
+        не доходит до истории и рассылки."""
+
+        limiter = self.command_limiters.get(command.name)
+        if self.user_limiter and not self.user_limiter.allow(command.login):
+            self.rate_limited['command'].inc()
+            await self.write_to_client(
+                command.address, 'Too many requests, please slow down.')
+        elif limiter and not limiter.allow(command.login):
+            self.rate_limited['command'].inc()
+            if command.name != SEND_MESSAGE:
+                await self.write_to_client(
+                    command.address, 'Too many requests, please slow down.')
+                return
+            for adr in self.users[command.login].addresses:
+                await self.write_to_client(
+                    adr, (f'Sorry, but you have reached your limit '
+                          f'of {self.sent_message_per_user} per hour. '
+                          f'The message not be sent.'))
+        else:
+            await call_next(command)
 
     async def chatting_with_user(self, address: str, login: str) -> None:
         """Обработка запросов от клиентов."""
 
         while True:
             message = await self.read_from_client(address)
-            if message == EXIT:
+            if message == EXIT or not message:
                 await self.close_client_connection(address, login)
                 break
-            elif message == SHOW_UNREAD_MESSAGES:
-                await self.show_unread(login, address)
-            elif message == USER_STATUS:
-                await self.show_status(login, address)
-            elif message.startswith(SEND_PRIVATE_MESSAGE):
-                await self.send_private(message, login, address)
-            elif message.startswith(SEND_TO_CHAT):
-                await self.send_to_chat(message, login, address)
-            elif message.startswith(SEND_MESSAGE):
-                await self.send(message, login, address)
-            elif message.startswith(CREATE_CHAT):
-                await self.create_chat(message, login, address)
-            elif message.startswith(INVITE_TO_CHAT):
-                await self.invite_user_to_chat(message, login, address)
-            elif message.startswith(JOIN_TO_CHAT):
-                await self.join_to_chat(message, login, address)
-            else:
-                await self.write_to_client(address, 'Wrong command.')
+            await self.router.dispatch(message, login, address)
 
     async def new_connection(self,
                              reader: StreamReader,
@@ -483,10 +883,21 @@ class Server:
                              ) -> None:
         """Установка нового соединения с клиентом."""
 
-        ip, port = writer.get_extra_info('peername')
+        ip, port = writer.get_extra_info('peername')[:2]
+        if not self.allow_connection(ip):
+            writer.write(encode_line('Too many connections, try again later.'))
+            writer.close()
+            return
         address = f'{ip}:{port}'
         logger.info('New client connected from %s:%s', ip, port)
-        self.connections[address] = reader, writer
+        self.connections_total.inc()
+        self.connections[address] = Connection(
+            address,
+            reader,
+            writer,
+            self.outbound_limits,
+            self.overflow_stats,
+            self.socket_write_timing)
         login = await self.user_authorization(address)
         if login:
             logger.info('User %s authorized.', login)
@@ -494,15 +905,36 @@ class Server:
             await self.chatting_with_user(address, login)
 
     async def run_server(self) -> None:
-        instance = await asyncio.start_server(self.new_connection, self.host, self.port)
+        if self.journal:
+            self.restore()
+            self.journal.open()
+            self.journal.state_provider = self.dump_state
+        if self.broker:
+            await self.broker.connect()
+        self.lag_task = asyncio.create_task(
+            watch_loop_lag(self.loop_lag, self.loop_lag_last))
+        if self.metrics_port:
+            await MetricsServer(
+                self.metrics, self.host, self.metrics_port).start()
+        instance = await asyncio.start_server(
+            self.new_connection,
+            self.host,
+            self.port,
+            limit=MAX_LINE_LENGTH,
+            reuse_port=self.reuse_port or None)
         logger.info('Server running at %s:%s', self.host, self.port)
         if not self.event_loop:
-            async with instance:
-                await instance.serve_forever()
+            try:
+                async with instance:
+                    await instance.serve_forever()
+            finally:
+                self.hasher.close()
+                if self.journal:
+                    await self.journal.close()
 
 
 if __name__ == '__main__':
-    server = Server()
+    server = Server(journal_dir=JOURNAL_DIR)
     try:
         asyncio.run(server.run_server())
     except KeyboardInterrupt:
@@ -1,14 +1,26 @@
 import asyncio
+import os
 import socket
+import tempfile
 import threading
 import time
 from signal import SIG_DFL, SIGPIPE, signal
 from unittest import TestCase
 
+from connection import (DISCONNECT, DROP_NEW, DROP_OLDEST, Connection,
+                        OutboundLimits)
+from history import GENERAL_CHANNEL, History, private_channel
+from journal import SNAPSHOT_FILE, Journal
+from metrics import Registry
+from models import Message
+from passwords import PasswordHasher, is_hashed
+from ratelimit import Limit, RateLimiter
+from router import UNKNOWN, CommandRouter, error_isolation
 from server import Server
-from utils import (AUTH, AUTH_OR_LOGIN, BYTES, EXIT, GENERAL_CHAT, HOST,
-                   INPUT_LOGIN, INPUT_PASSWORD, LOGIN, LOGIN_SET,
-                   LOGIN_SUCCESSFUL, PORT, SEND_MESSAGE)
+from utils import (AUTH, AUTH_OR_LOGIN, EXIT, GENERAL_CHAT, HOST, INPUT_LOGIN,
+                   INPUT_PASSWORD, INVALID_SESSION, LOGIN, LOGIN_SET,
+                   LOGIN_SUCCESSFUL, MAX_LINE_LENGTH, PORT, RESUME,
+                   RESUME_TOKEN, SEND_MESSAGE)
 
 signal(SIGPIPE, SIG_DFL)
 
@@ -44,6 +56,250 @@ class LoopRunner(threading.Thread):
         return self.run_in_thread(self._stop())
 
 
+class TestHistory(TestCase):
+    """Тестирование хранилища истории по каналам."""
+
+    def test_channels(self):
+        history = History()
+        first = history.append(Message('hi', 'user1'))
+        history.append(Message('secret', 'user1', True, recipient='user2'))
+        history.append(Message('chat', 'user2', True, chat_name='room'))
+        last = history.append(Message('bye', 'user2'))
+
+        self.assertEqual(len(history), 4)
+        self.assertEqual((first.id, last.id), (1, 4))
+        self.assertEqual(history.tail(GENERAL_CHANNEL, 1), [last])
+        self.assertEqual(history.tail(GENERAL_CHANNEL, 5), [first, last])
+        self.assertEqual(history.count_private('user1'), 1)
+        self.assertEqual(history.count_private('user2'), 1)
+
+        channel = private_channel('user2', 'user1')
+        self.assertEqual(history.private_channels['user2'], {channel})
+        since = history.since([GENERAL_CHANNEL, channel], 0)
+        self.assertEqual([msg.id for msg in since], [1, 2, 4])
+        since = history.since([GENERAL_CHANNEL], last.timestamp)
+        self.assertEqual(list(since), [])
+
+
+class StalledTransport:
+    """Транспорт клиента, который перестал читать: всё записанное остаётся
+    в буфере."""
+
+    def __init__(self):
+        self.buffer = 0
+        self.aborted = False
+
+    def get_write_buffer_size(self):
+        return self.buffer
+
+    def abort(self):
+        self.aborted = True
+
+
+class StalledWriter:
+    def __init__(self):
+        self.transport = StalledTransport()
+
+    def write(self, data):
+        self.transport.buffer += len(data)
+
+    async def drain(self):
+        await asyncio.sleep(3600)
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+class TestBackpressure(TestCase):
+    """Тестирование политик для медленного клиента."""
+
+    @staticmethod
+    def fill(policy, grace_period=0.05):
+        async def run():
+            limits = OutboundLimits(high_water=100, low_water=40,
+                                    policy=policy, grace_period=grace_period)
+            connection = Connection('client', None, StalledWriter(), limits)
+            await asyncio.sleep(0)
+            accepted = [connection.put(b'x' * 10) for _ in range(30)]
+            await asyncio.sleep(0.1)
+            connection.writer_task.cancel()
+            return connection, accepted
+
+        return asyncio.run(run())
+
+    def test_drop_new(self):
+        connection, accepted = self.fill(DROP_NEW)
+        # первое сообщение ушло в транспорт, девять ждут в очереди
+        self.assertEqual(accepted.count(True), 10)
+        self.assertEqual(connection.stats[DROP_NEW], 20)
+        self.assertLessEqual(connection.buffered, 100)
+
+    def test_drop_oldest(self):
+        connection, accepted = self.fill(DROP_OLDEST)
+        self.assertTrue(all(accepted))
+        self.assertGreater(connection.stats[DROP_OLDEST], 0)
+        self.assertLessEqual(connection.buffered, 100)
+        # в очереди остаются самые новые сообщения
+        self.assertEqual(connection.queue.qsize() * 10 + 10,
+                         connection.buffered)
+
+    def test_disconnect(self):
+        connection, _ = self.fill(DISCONNECT)
+        self.assertEqual(connection.stats[DISCONNECT], 1)
+        self.assertTrue(connection.writer.transport.aborted)
+        self.assertTrue(connection.closed)
+
+
+class TestMetrics(TestCase):
+    """Тестирование вывода метрик в формате Prometheus."""
+
+    def test_render(self):
+        registry = Registry()
+        registry.counter('requests_total', 'Requests.').inc(3)
+        registry.gauge('queue_depth', 'Depth.', lambda: 7)
+        histogram = registry.histogram('latency_seconds', 'Latency.',
+                                       command='/send')
+        for value in (0.0002, 0.003, 10):
+            histogram.observe(value)
+        text = registry.render()
+        self.assertIn('# TYPE requests_total counter\nrequests_total 3', text)
+        self.assertIn('queue_depth 7', text)
+        self.assertIn(
+            'latency_seconds_bucket{command="/send",le="0.00025"} 1', text)
+        self.assertIn(
+            'latency_seconds_bucket{command="/send",le="0.005"} 2', text)
+        self.assertIn(
+            'latency_seconds_bucket{command="/send",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count{command="/send"} 3', text)
+
+
+class TestRouter(TestCase):
+    """Тестирование разбора команд и цепочки middleware."""
+
+    def test_dispatch(self):
+        calls, replies = [], []
+
+        async def handler(command):
+            calls.append(command.args)
+            if command.args[0] == 'fail':
+                raise RuntimeError('failure')
+
+        async def fallback(command):
+            calls.append(command.name)
+
+        async def reply(address, text):
+            replies.append(text)
+
+        async def middleware(command, call_next):
+            calls.append('before')
+            await call_next(command)
+
+        router = CommandRouter(fallback)
+        router.register('/private', handler, nargs=2)
+        router.use(error_isolation(reply))
+        router.use(middleware)
+        with self.assertRaises(ValueError):
+            router.register('/private', handler)
+
+        async def run():
+            await router.dispatch('/private bob hello  world', 'ann', 'a')
+            await router.dispatch('/private bob', 'ann', 'a')
+            await router.dispatch('/private fail', 'ann', 'a')
+            await router.dispatch('/unknown', 'ann', 'a')
+
+        asyncio.run(run())
+        self.assertEqual(
+            calls,
+            ['before', ('bob', 'hello  world'), 'before', ('bob', ''),
+             'before', ('fail', ''), 'before', UNKNOWN])
+        self.assertEqual(replies, ['Command failed, please retry.'])
+
+
+class TestRateLimiter(TestCase):
+    """Тестирование корзин токенов."""
+
+    def test_allow(self):
+        limiter = RateLimiter(Limit(2, 3600))
+        self.assertEqual([limiter.allow('ann') for _ in range(3)],
+                         [True, True, False])
+        self.assertTrue(limiter.allow('bob'))
+        # за половину часа восстанавливается один токен
+        limiter.buckets['ann'].updated -= 1800
+        self.assertEqual([limiter.allow('ann') for _ in range(2)],
+                         [True, False])
+        limiter.buckets['bob'].updated -= 3600
+        limiter.cleanup(time.monotonic())
+        self.assertEqual(list(limiter.buckets), ['ann'])
+
+
+class TestPasswords(TestCase):
+    """Тестирование хеширования паролей и кеша проверенных входов."""
+
+    def test_verify(self):
+        hasher = PasswordHasher(workers=2)
+        hasher.register_metrics(Registry())
+
+        async def run():
+            stored = await hasher.hash('secret')
+            self.assertTrue(is_hashed(stored))
+            self.assertNotIn('secret', stored)
+            self.assertFalse(await hasher.verify('ann', 'wrong', stored))
+            self.assertTrue(await hasher.verify('ann', 'secret', stored))
+            self.assertTrue(await hasher.verify('ann', 'secret', stored))
+            self.assertFalse(await hasher.verify('ann', 'wrong', stored))
+            self.assertTrue(await hasher.verify('bob', 'legacy', 'legacy'))
+
+        asyncio.run(run())
+        hasher.close()
+        self.assertEqual(hasher.cache_hits.value, 1)
+        self.assertEqual(hasher.hash_timing.count, 5)
+
+
+class TestJournal(TestCase):
+    """Тестирование журнала операций, снимков и восстановления."""
+
+    def test_restore(self):
+        with tempfile.TemporaryDirectory() as directory:
+            server = Server()
+            server.journal = Journal(directory, snapshot_every=3, sync=False)
+
+            async def fill():
+                server.journal.open()
+                server.journal.state_provider = server.dump_state
+                for login in ('user1', 'user2'):
+                    server.restore_user({'login': login, 'password': 'pw'})
+                    await server.save('user', login=login, password='pw')
+                server.restore_chat({'name': 'room', 'admin': 'user1'})
+                await server.save('chat', name='room', admin='user1')
+                server.restore_join({'chat': 'room', 'login': 'user2'})
+                await server.save('join', chat='room', login='user2')
+                for text in ('one', 'two', 'three'):
+                    message = Message(text, 'user2', True, chat_name='room')
+                    server.history.append(message)
+                    await server.save_message(message)
+                await server.journal.close()
+
+            asyncio.run(fill())
+            self.assertTrue(os.path.exists(os.path.join(directory,
+                                                        SNAPSHOT_FILE)))
+
+            restored = Server(journal_dir=directory)
+            restored.restore()
+            self.assertEqual(set(restored.users), {'user1', 'user2'})
+            self.assertEqual(restored.users['user2'].password, 'pw')
+            chat = restored.chats['room']
+            self.assertEqual([user.login for user in chat.users],
+                             ['user1', 'user2'])
+            self.assertEqual(len(restored.history), 3)
+            self.assertEqual(
+                [msg.body for msg in restored.history.messages()],
+                ['one', 'two', 'three'])
+            self.assertEqual(restored.journal.seq, 7)
+
+
 class TestServer(TestCase):
     """Тестирование обработки запросов сервером."""
 
@@ -51,20 +307,30 @@ class TestServer(TestCase):
         self.loop = asyncio.new_event_loop()
         self.runner = LoopRunner(self.loop)
         self.runner.start()
+        self.buffers = {}
 
     def tearDown(self) -> None:
         self.runner.stop()
         self.runner.join()
 
-    @staticmethod
-    def connect_to_server(sock):
-        sock.connect((HOST, PORT))
-        return sock.recv(BYTES)
+    def connect_to_server(self, sock, port=PORT):
+        sock.connect((HOST, port))
+        return self.recv_message(sock)
 
-    @staticmethod
-    def send_recv_message(sock, message):
-        sock.send(message)
-        return sock.recv(BYTES)
+    def send_recv_message(self, sock, message):
+        sock.send(message + b'\n')
+        return self.recv_message(sock)
+
+    def recv_message(self, sock):
+        """Чтение одной строки протокола: несколько сообщений сервера могут
+        прийти одним сегментом - разбираем их по переводу строки."""
+
+        buffer = self.buffers.get(sock, b'')
+        while b'\n' not in buffer:
+            buffer += sock.recv(MAX_LINE_LENGTH)
+        line, buffer = buffer.split(b'\n', 1)
+        self.buffers[sock] = buffer
+        return line + b'\n'
 
     def test_server_methods(self):
         """Тестирование подключения к серверу и обработки запросов."""
@@ -85,14 +351,16 @@ class TestServer(TestCase):
         # проверяем приглашение на авторизацию и создаем нового пользователя
         self.assertEqual(data.decode(), f'{AUTH_OR_LOGIN}\n')
         data = self.send_recv_message(sock1, AUTH.encode())
-        self.assertEqual(data.decode(), INPUT_LOGIN)
+        self.assertEqual(data.decode(), f'{INPUT_LOGIN}\n')
         data = self.send_recv_message(sock1, 'new_user'.encode())
-        self.assertEqual(data.decode(), INPUT_PASSWORD)
+        self.assertEqual(data.decode(), f'{INPUT_PASSWORD}\n')
         data = self.send_recv_message(sock1, 'password'.encode())
 
         # проверяем вход в чат и количество созданных юзеров
         self.assertEqual(data.decode(), f'{LOGIN_SET}\n')
-        data = sock1.recv(BYTES)
+        data = self.recv_message(sock1)
+        self.assertTrue(data.decode().startswith(RESUME_TOKEN))
+        data = self.recv_message(sock1)
         self.assertEqual(data.decode(), f'{GENERAL_CHAT}\n')
         self.assertEqual(len(server.users), 1)
 
@@ -109,7 +377,9 @@ class TestServer(TestCase):
         # проверяем вход в чат и то, что количество пользователей осталось
         # прежним
         self.assertEqual(data.decode(), f'{LOGIN_SUCCESSFUL}\n')
-        data = sock2.recv(BYTES)
+        data = self.recv_message(sock2)
+        self.assertTrue(data.decode().startswith(RESUME_TOKEN))
+        data = self.recv_message(sock2)
         self.assertEqual(data.decode(), f'{GENERAL_CHAT}\n')
         self.assertEqual(len(server.users), 1)
 
@@ -120,14 +390,16 @@ class TestServer(TestCase):
         # проверяем приглашение на авторизацию и создаем второго пользователя
         self.assertEqual(data.decode(), f'{AUTH_OR_LOGIN}\n')
         data = self.send_recv_message(sock3, AUTH.encode())
-        self.assertEqual(data.decode(), INPUT_LOGIN)
+        self.assertEqual(data.decode(), f'{INPUT_LOGIN}\n')
         data = self.send_recv_message(sock3, 'another_user'.encode())
-        self.assertEqual(data.decode(), INPUT_PASSWORD)
+        self.assertEqual(data.decode(), f'{INPUT_PASSWORD}\n')
         data = self.send_recv_message(sock3, 'another_password'.encode())
 
         # проверяем вход в чат и количество созданных пользователей
         self.assertEqual(data.decode(), f'{LOGIN_SET}\n')
-        data = sock3.recv(BYTES)
+        data = self.recv_message(sock3)
+        self.assertTrue(data.decode().startswith(RESUME_TOKEN))
+        data = self.recv_message(sock3)
         self.assertEqual(data.decode(), f'{GENERAL_CHAT}\n')
         self.assertEqual(len(server.users), 2)
 
@@ -138,14 +410,16 @@ class TestServer(TestCase):
         # проверяем приглашение на авторизацию и создаем третьего пользователя
         self.assertEqual(data.decode(), f'{AUTH_OR_LOGIN}\n')
         data = self.send_recv_message(sock4, AUTH.encode())
-        self.assertEqual(data.decode(), INPUT_LOGIN)
+        self.assertEqual(data.decode(), f'{INPUT_LOGIN}\n')
         data = self.send_recv_message(sock4, 'user3'.encode())
-        self.assertEqual(data.decode(), INPUT_PASSWORD)
+        self.assertEqual(data.decode(), f'{INPUT_PASSWORD}\n')
         data = self.send_recv_message(sock4, 'password3'.encode())
 
         # проверяем вход в чат и количество созданных пользователей
         self.assertEqual(data.decode(), f'{LOGIN_SET}\n')
-        data = sock4.recv(BYTES)
+        data = self.recv_message(sock4)
+        self.assertTrue(data.decode().startswith(RESUME_TOKEN))
+        data = self.recv_message(sock4)
         self.assertEqual(data.decode(), f'{GENERAL_CHAT}\n')
         self.assertEqual(len(server.users), 3)
 
@@ -156,11 +430,11 @@ class TestServer(TestCase):
         self.assertIn('says: hi!', data.decode())
 
         # проверяем получение сообщения первым подключением
-        data = sock1.recv(BYTES)
+        data = self.recv_message(sock1)
         self.assertIn('says: hi!', data.decode())
 
         # проверяем получение сообщения третьим подключением
-        data = sock3.recv(BYTES)
+        data = self.recv_message(sock3)
         self.assertIn('says: hi!', data.decode())
 
         # убеждаемся что в истории сохранено одно сообщение
@@ -173,7 +447,7 @@ class TestServer(TestCase):
         self.assertIn('says: hi again!', data.decode())
 
         # а также получено другим подключением
-        data = sock2.recv(BYTES)
+        data = self.recv_message(sock2)
         self.assertIn('says: hi again!', data.decode())
 
         # проверяем что в истории сохранено два сообщения
@@ -191,12 +465,102 @@ class TestServer(TestCase):
         self.assertEqual(len(server.history), 2)
 
         # отключаем клиентов
-        sock1.send(EXIT.encode())
-        sock2.send(EXIT.encode())
-        sock3.send(EXIT.encode())
-        sock4.send(EXIT.encode())
+        sock1.send(EXIT.encode() + b'\n')
+        sock2.send(EXIT.encode() + b'\n')
+        sock3.send(EXIT.encode() + b'\n')
+        sock4.send(EXIT.encode() + b'\n')
+        time.sleep(0.5)
+        sock1.close()
+        sock2.close()
+        sock3.close()
+        sock4.close()
+
+    def test_pipelined_commands(self):
+        """Тестирование конвейерной отправки нескольких команд одним
+        сегментом и обработки слишком длинной строки."""
+
+        port = PORT + 1
+        server = Server(event_loop=self.loop, port=port)
+        self.runner.run_coroutine(server.run_server())
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect_to_server(sock, port)
+
+        # авторизация и две команды уходят одним пакетом
+        sock.send(b'/auth\nbot\nsecret\n/send first\n/send second\n')
+        expected = [f'{INPUT_LOGIN}\n', f'{INPUT_PASSWORD}\n',
+                    f'{LOGIN_SET}\n']
+        for line in expected:
+            self.assertEqual(self.recv_message(sock).decode(), line)
+        self.assertTrue(
+            self.recv_message(sock).decode().startswith(RESUME_TOKEN))
+        self.assertEqual(self.recv_message(sock).decode(), f'{GENERAL_CHAT}\n')
+        self.assertIn('says: first', self.recv_message(sock).decode())
+        self.assertIn('says: second', self.recv_message(sock).decode())
+        self.assertEqual(len(server.history), 2)
+
+        # слишком длинная строка отвергается целиком, следующая команда
+        # обрабатывается как обычно
+        sock.send(b'/send ' + b'x' * MAX_LINE_LENGTH * 2 + b'\n/send third\n')
+        self.assertIn('longer than', self.recv_message(sock).decode())
+        self.assertIn('says: third', self.recv_message(sock).decode())
+        self.assertEqual(len(server.history), 3)
+
+        sock.send(EXIT.encode() + b'\n')
         time.sleep(0.5)
+        sock.close()
+
+    def test_resume_session(self):
+        """Тестирование входа по токену сессии и получения сообщений,
+        пропущенных после отключения."""
+
+        port = PORT + 2
+        server = Server(event_loop=self.loop, port=port)
+        self.runner.run_coroutine(server.run_server())
+        sock1 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock2 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock3 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect_to_server(sock1, port)
+        self.connect_to_server(sock2, port)
+
+        sock1.send(b'/auth\nann\nsecret\n')
+        for _ in range(3):
+            self.recv_message(sock1)
+        token = self.recv_message(sock1).decode()[len(RESUME_TOKEN):].strip()
+        self.assertEqual(self.recv_message(sock1).decode(), f'{GENERAL_CHAT}\n')
+        sock2.send(b'/auth\nbob\nsecret\n')
+        for _ in range(5):
+            self.recv_message(sock2)
+
+        # первый пользователь отключается и пропускает два сообщения
+        self.send_recv_message(sock1, EXIT.encode())
         sock1.close()
+        self.assertIn('says: missed',
+                      self.send_recv_message(sock2, b'/send missed').decode())
+        self.send_recv_message(sock2, b'/private ann missed too')
+
+        # вход по токену за один запрос, без логина и пароля
+        self.connect_to_server(sock3, port)
+        data = self.send_recv_message(sock3, f'{RESUME} {token}'.encode())
+        self.assertEqual(data.decode(), f'{LOGIN_SUCCESSFUL}\n')
+        self.assertEqual(self.recv_message(sock3).decode(), f'{GENERAL_CHAT}\n')
+        self.assertIn('says: missed', self.recv_message(sock3).decode())
+        self.assertIn('in private says: missed too',
+                      self.recv_message(sock3).decode())
+
+        self.assertEqual(len(server.users['ann'].addresses), 1)
+
+        # неизвестный токен отвергается, клиенту снова предлагается вход
+        data = self.send_recv_message(sock2, EXIT.encode())
         sock2.close()
+        sock4 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect_to_server(sock4, port)
+        data = self.send_recv_message(sock4, f'{RESUME} wrong'.encode())
+        self.assertEqual(data.decode(), f'{INVALID_SESSION}\n')
+        self.assertEqual(self.recv_message(sock4).decode(),
+                         f'{AUTH_OR_LOGIN}\n')
+
+        for sock in (sock3, sock4):
+            sock.send(EXIT.encode() + b'\n')
+        time.sleep(0.5)
         sock3.close()
         sock4.close()
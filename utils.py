@@ -1,12 +1,16 @@
 import logging
 import sys
 
-BYTES = 1024
+MAX_LINE_LENGTH = 64 * 1024
+LINE_END = b'\n'
 HOST = '127.0.0.1'
 PORT = 8000
+JOURNAL_DIR = 'chat_data'
+SESSION_FILE = '.chat_session'
 
 LOGIN = '/login'
 AUTH = '/auth'
+RESUME = '/resume'
 EXIT = '/exit'
 SHOW_UNREAD_MESSAGES = '/unread'
 USER_STATUS = '/status'
@@ -16,8 +20,11 @@ CREATE_CHAT = '/create'
 SEND_TO_CHAT = '/send_chat'
 INVITE_TO_CHAT = '/invite'
 JOIN_TO_CHAT = '/join'
+METRICS = '/metrics'
 
 COMMANDS_DESCRIPTION = {
+    RESUME: ('<token> [last message id] - resume the previous session, '
+             'the client does it automatically'),
     EXIT: '- disconnect from server',
     SHOW_UNREAD_MESSAGES: '- show all unread message in general chat',
     USER_STATUS: '- show user status',
@@ -32,6 +39,7 @@ COMMANDS_DESCRIPTION = {
     JOIN_TO_CHAT: ('<chat name> <invite-key or empty> - '
                    'join to the private chat, or send request for the '
                    'invite-key'),
+    METRICS: '- show server metrics (admins only)',
 }
 
 AUTH_OR_LOGIN = 'Please, register (/auth) or log in (/login).'
@@ -40,6 +48,8 @@ INPUT_PASSWORD = 'Input your password: '
 GENERAL_CHAT = 'You are in general chat.'
 LOGIN_SET = 'Login and password was set.'
 LOGIN_SUCCESSFUL = 'Login successful.'
+RESUME_TOKEN = 'Your resume token: '
+INVALID_SESSION = 'Resume token is invalid or expired.'
 
 
 def get_logger() -> logging.Logger: